@@ -1,9 +1,31 @@
-import random
+import numpy as np
 
+import randomness
+
+# Aircraft a new game starts with, the current selection is kept in
+# Database.selected_aircraft
 selected_aircraft = "Cessna 208 Caravan"
 
-def get_selected_aircraft():
-    return selected_aircraft
+START_MONEY = 3_950_000
+
+# Contents of the aircraft table, inserted by Database.reset()
+COLUMNS = (
+    "id", "name", "category", "capacity", "speed_kmh", "range_km", "fuel_tank_l",
+    "fuel_consumption_lph", "co2_emissions_kgph", "price_million", "owned",
+)
+CATALOG = [
+    (1, 'Cessna 208 Caravan', 'Small', 9, 340, 1700, 1300, 220, 560, 3.00, 1),
+    (2, 'DHC-6 Twin Otter', 'Medium', 19, 330, 1500, 2000, 400, 1000, 5.00, 0),
+    (3, 'Learjet 75', 'Medium', 12, 860, 3700, 6000, 700, 1900, 5.25, 0),
+    (4, 'Boeing 747-8', 'Large', 400, 920, 14000, 240000, 12000, 30000, 250.00, 0),
+    (5, 'Boeing 747-8 VIP', 'Large', 50, 920, 14000, 240000, 12000, 30000, 250.00, 0),
+]
+
+def catalog_stats(aircraft):
+    for row in CATALOG:
+        if row[1] == aircraft:
+            return dict(zip(COLUMNS, row))
+    return None
 
 def get_aircraft_range(con, aircraft):
     cur = con.cursor()
@@ -27,6 +49,17 @@ def purchase_aircraft(con, aircraft):
     query = "UPDATE aircraft SET owned = 1 WHERE name = ?"
     cur.execute(query, (aircraft,))
 
+# Whole aircraft row as a dict, keys from COLUMNS
+def get_stats(con, aircraft):
+    cur = con.cursor()
+    query = "SELECT " + ", ".join(COLUMNS) + " FROM aircraft WHERE name = ?"
+    cur.execute(query, (aircraft,))
+    result = cur.fetchone()
+    return dict(zip(COLUMNS, result))
+
+def purchase_cost(price_million):
+    return int(price_million * 1_000_000)
+
 def get_fuel_burn_per_km(con, aircraft):
     cur = con.cursor()
     query = "SELECT fuel_consumption_lph FROM aircraft WHERE name = ?"
@@ -41,20 +74,31 @@ def get_aircraft_type(con, aircraft):
     result = cur.fetchone()
     return result[0]
 
-def get_payout(distance, aircraft_fuel_burn_per_km, aircraft_type):
+# Share of the fuel costs paid out, per aircraft category
+PAYOUT_FACTOR = {
+    "Small": 0.25,
+    "Medium": 3.5,
+    "Large": 10,
+}
+
+# rng defaults to the game's generator (randomness.py), the economy simulator
+# passes its own random.Random per career
+def get_payout(distance, aircraft_fuel_burn_per_km, aircraft_type, rng=None):
+    if rng is None:
+        rng = randomness.source
+
     costs = distance * aircraft_fuel_burn_per_km
-    payout = 0
-    if aircraft_type == "Small":
-        payout = costs * 0.25
-    elif aircraft_type == "Medium":
-        payout = costs * 3.5
-    elif aircraft_type == "Large":
-        payout = costs * 10
-    else:
-        pass
+    payout = costs * PAYOUT_FACTOR.get(aircraft_type, 0)
 
     payout = payout / 10
 
-    random_factor = random.uniform(0.6, 1.6)
+    random_factor = rng.uniform(0.6, 1.6)
     rounded = round(payout * random_factor, -2)
-    return int(rounded)
\ No newline at end of file
+    return int(rounded)
+
+
+# get_payout() for a NumPy array of distances, rng is a numpy.random.Generator
+def get_payouts(distances, aircraft_fuel_burn_per_km, aircraft_type, rng):
+    payout = distances * aircraft_fuel_burn_per_km * PAYOUT_FACTOR.get(aircraft_type, 0) / 10
+    random_factor = rng.uniform(0.6, 1.6, size=len(distances))
+    return np.round(payout * random_factor, -2).astype(np.int64)
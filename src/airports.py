@@ -0,0 +1,155 @@
+# Airports.py
+
+# In-memory index of the airport table. Rendering code used to query the
+# database for every label on every frame; instead the airports we care about
+# are read once at startup (on a loader thread, see loader.py) and kept in
+# column lists.
+
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+
+
+class AirportIndex:
+    def __init__(self, rows):
+        # Columns, one entry per airport
+        self.ident        = []
+        self.type         = []
+        self.lon          = []
+        self.lat          = []
+        self.country      = []
+        self.municipality = []
+
+        # ICAO -> row
+        self.rows = {}
+
+        for (ident, kind, lon, lat, country, municipality) in rows:
+            self.rows[ident] = len(self.ident)
+            self.ident.append(ident)
+            self.type.append(kind)
+            self.lon.append(lon)
+            self.lat.append(lat)
+            self.country.append(country)
+            self.municipality.append(municipality)
+
+        # Precomputed row lists for the airport types drawn on the map
+        self.by_type = {}
+        for i in range(len(self.ident)):
+            self.by_type.setdefault(self.type[i], []).append(i)
+
+        # Unit vectors (earth centered, radius 1) for vectorized great circle
+        # math, one row per airport
+        lon = np.radians(np.array(self.lon, dtype=np.float64))
+        lat = np.radians(np.array(self.lat, dtype=np.float64))
+        self.unit = np.column_stack((
+            np.cos(lat) * np.cos(lon),
+            np.cos(lat) * np.sin(lon),
+            np.sin(lat),
+        ))
+
+        # Cached results of where()
+        self.selections = {}
+
+    def __len__(self):
+        return len(self.ident)
+
+    def __contains__(self, icao):
+        return icao in self.rows
+
+    def xy(self, icao):
+        i = self.rows[icao]
+        return [self.lon[i], self.lat[i]]
+
+    def of_type(self, *types):
+        ret = []
+        for kind in types:
+            ret.extend(self.by_type.get(kind, []))
+        return ret
+
+    # Rows of the given types (and country, if set) as a NumPy array
+    def where(self, types, country=None):
+        key = (types, country)
+        rows = self.selections.get(key)
+        if rows is None:
+            rows = np.array([
+                i for i in self.of_type(*types)
+                if country is None or self.country[i] == country
+            ], dtype=np.int64)
+            rows.sort()
+            self.selections[key] = rows
+        return rows
+
+    # Great circle distance from icao to every airport, in km
+    def distances_from(self, icao):
+        dots = self.unit @ self.unit[self.rows[icao]]
+        return EARTH_RADIUS_KM * np.arccos(np.clip(dots, -1.0, 1.0))
+
+    # Same, but only to the given rows
+    def distances(self, icao, rows):
+        dots = self.unit[rows] @ self.unit[self.rows[icao]]
+        return EARTH_RADIUS_KM * np.arccos(np.clip(dots, -1.0, 1.0))
+
+
+# Points on the circle of radius_km around (lon, lat), for drawing ranges.
+# Longitudes are continuous like compute_geodesic()'s in map.py, so a circle
+# around a pole ends a whole turn from where it started instead of jumping
+# back across the map halfway.
+def range_circle(lon, lat, radius_km, steps=64):
+    d = radius_km / EARTH_RADIUS_KM
+    lon0 = math.radians(lon)
+    lat0 = math.radians(lat)
+    points = []
+    for step in range(steps+1):
+        bearing = 2.0 * math.pi * step / steps
+        lat1 = math.asin(math.sin(lat0) * math.cos(d) + math.cos(lat0) * math.sin(d) * math.cos(bearing))
+        lon1 = lon0 + math.atan2(
+            math.sin(bearing) * math.sin(d) * math.cos(lat0),
+            math.cos(d) - math.sin(lat0) * math.sin(lat1))
+        lon1 = math.degrees(lon1)
+        if points:
+            lon1 += 360.0 * round((points[-1][0] - lon1) / 360.0)
+        points.append([lon1, math.degrees(lat1)])
+    return points
+
+
+# Which airports an aircraft can reach from a given airport
+class Reach:
+    def __init__(self, airports, icao, range_km):
+        self.icao = icao
+        self.range_km = range_km
+        self.distance = airports.distances_from(icao)
+        # Boolean per airport row
+        self.mask = self.distance <= range_km
+        self.mask[airports.rows[icao]] = False
+        self.circle = range_circle(airports.lon[airports.rows[icao]], airports.lat[airports.rows[icao]], range_km)
+
+    def __contains__(self, row):
+        return bool(self.mask[row])
+
+
+# Reach results cached per (airport, aircraft)
+class ReachCache:
+    def __init__(self, airports):
+        self.airports = airports
+        self.cache = {}
+
+    def get(self, icao, aircraft_name, range_km):
+        key = (icao, aircraft_name)
+        reach = self.cache.get(key)
+        if reach is None or reach.range_km != range_km:
+            reach = Reach(self.airports, icao, range_km)
+            self.cache[key] = reach
+        return reach
+
+
+def load_airports(con):
+    cur = con.cursor()
+    query = """
+        SELECT ident, type, longitude_deg, latitude_deg, iso_country, municipality
+        FROM airport
+        WHERE type IN ('small_airport', 'medium_airport', 'large_airport')
+    """
+    cur.execute(query)
+    return AirportIndex(cur.fetchall())
@@ -0,0 +1,174 @@
+# Ansi.py
+
+# Terminal output with ANSI escape sequences, without curses.
+#
+# With curses every cell scanout() changes is an addch() call with its own
+# color pair lookup, and curses then works out what to send. Here drawing
+# only fills in a CellWindow grid; refresh() compares it to what the terminal
+# already shows and builds one string for the whole frame:
+#
+# - rows that didn't change are skipped whole
+# - inside a row the cursor jumps over unchanged cells, unless rewriting the
+#   gap is shorter than the jump
+# - the color is only switched where it changes, not per cell
+#
+# and writes it out in one go. Used for the local terminal with
+# "python ./src/main.py --ansi" (terminal.py) and by the game server
+# (server.py). Nothing here needs a POSIX terminal, so the server still
+# imports on Windows.
+
+import curses
+from collections import deque
+
+from headless import CellWindow
+
+ESC = 27
+ARROWS = {
+    ord("A"): curses.KEY_UP,
+    ord("B"): curses.KEY_DOWN,
+    ord("C"): curses.KEY_RIGHT,
+    ord("D"): curses.KEY_LEFT,
+}
+
+# Hide the cursor and clear the screen, and undo that on the way out
+SCREEN_INIT  = "\x1b[?25l\x1b[0m\x1b[2J"
+SCREEN_RESET = "\x1b[0m\x1b[2J\x1b[H\x1b[?25h"
+
+RESET = "\x1b[0m"
+
+# Unchanged cells up to this long are rewritten instead of jumped over, a
+# cursor move is about this many bytes
+MAX_GAP = 6
+
+
+# color_pairs is pair -> (foreground, background), as in main.COLOR_PAIRS
+class AnsiWindow(CellWindow):
+    def __init__(self, h, w, color_pairs):
+        # What the terminal shows. None to clear it and repaint everything.
+        self.front_cells = None
+        self.front_attrs = None
+        # Attribute the terminal is currently drawing with
+        self.attr = 0
+        # Called after the window was resized
+        self.on_resize = None
+
+        # Keys parsed by feed(), and bytes of an unfinished sequence
+        self.input = deque()
+        self.pending = b""
+        self.after_cr = False
+
+        super().__init__(h, w)
+
+        # Escape sequence per attribute
+        self.sgr = {0: RESET}
+        for (pair, (fg, bg)) in color_pairs.items():
+            self.sgr[self.color_pair(pair)] = f"\x1b[0;38;5;{fg};48;5;{bg}m"
+
+    def resize(self, h, w):
+        super().resize(h, w)
+        self.front_cells = None
+        if self.on_resize is not None:
+            self.on_resize()
+
+    # Escape sequences that bring the terminal up to date with the grid
+    def render(self):
+        out = []
+        if self.front_cells is None:
+            # Starts from a cleared screen
+            out.append(SCREEN_INIT)
+            self.attr = 0
+            self.front_cells = [[" "] * self.w for y in range(self.h)]
+            self.front_attrs = [[0] * self.w for y in range(self.h)]
+
+        w = self.w
+        attr = self.attr
+        sgr = self.sgr
+        for y in range(self.h):
+            cells = self.cells[y]
+            attrs = self.attrs[y]
+            front_cells = self.front_cells[y]
+            front_attrs = self.front_attrs[y]
+            if cells == front_cells and attrs == front_attrs:
+                continue
+
+            # Characters of the current color run
+            run = []
+            # Column the cursor is at, -1 if not on this row yet
+            cursor = -1
+            x = 0
+            while x < w:
+                if cells[x] == front_cells[x] and attrs[x] == front_attrs[x]:
+                    x += 1
+                    continue
+
+                if cursor >= 0 and x - cursor <= MAX_GAP:
+                    start = cursor
+                else:
+                    if run:
+                        out.append("".join(run))
+                        run = []
+                    out.append(f"\x1b[{y+1};{x+1}H")
+                    start = x
+
+                end = x+1
+                while end < w and (cells[end] != front_cells[end] or attrs[end] != front_attrs[end]):
+                    end += 1
+
+                for i in range(start, end):
+                    if attrs[i] != attr:
+                        if run:
+                            out.append("".join(run))
+                            run = []
+                        attr = attrs[i]
+                        out.append(sgr.get(attr, RESET))
+                    run.append(cells[i])
+
+                front_cells[start:end] = cells[start:end]
+                front_attrs[start:end] = attrs[start:end]
+                cursor = end
+                x = end
+
+            if run:
+                out.append("".join(run))
+
+        self.attr = attr
+        return "".join(out)
+
+    def getch(self):
+        if self.input:
+            return self.input.popleft()
+        return -1
+
+    # Parse bytes typed on the terminal into keys for getch()
+    def feed(self, data):
+        data = self.pending + data
+        i = 0
+        n = len(data)
+        while i < n:
+            b = data[i]
+
+            if self.after_cr:
+                self.after_cr = False
+                # Enter can arrive as CR LF or CR NUL
+                if b == 10 or b == 0:
+                    i += 1
+                    continue
+
+            if b == ESC:
+                if i+2 >= n:
+                    break
+                if data[i+1] in b"[O" and data[i+2] in ARROWS:
+                    self.input.append(ARROWS[data[i+2]])
+                    i += 3
+                else:
+                    i += 1
+                continue
+
+            if b == 13:
+                self.input.append(10)
+                self.after_cr = True
+            elif b < 128:
+                self.input.append(b)
+            i += 1
+
+        self.pending = data[i:]
@@ -0,0 +1,138 @@
+# Bands.py
+
+# Opt-in parallel map rasterizer.
+#
+# The frame is split into horizontal bands which are rasterized by a pool of
+# worker processes. Workers write straight into one shared memory framebuffer,
+# so nothing but the band coordinates is sent per frame. The map geometry is
+# copied into shared memory once per level of detail (see MapGeometry.lod())
+# and read by all workers, see raster.py for the rasterization itself. Since
+# every band is rasterized on the same global cell grid, the result is
+# identical to the single threaded renderer.
+
+import os
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+from raster import rasterize
+
+
+# Read-only view of MapGeometry arrays living in shared memory
+class SharedGeometry:
+    def __init__(self, buf, n_vertices, n_parts):
+        mv = memoryview(buf)
+        o = 0
+        self.x = mv[o:o + 8*n_vertices].cast('d'); o += 8*n_vertices
+        self.y = mv[o:o + 8*n_vertices].cast('d'); o += 8*n_vertices
+        self.bbox = mv[o:o + 32*n_parts].cast('d'); o += 32*n_parts
+        self.parts = mv[o:o + 4*(n_parts+1)].cast('i')
+
+
+def geometry_size(n_vertices, n_parts):
+    return 16*n_vertices + 32*n_parts + 4*(n_parts+1)
+
+
+# Worker process state
+# Shared memory name -> (memory, SharedGeometry)
+_geoms = {}
+_fb_shm = {}
+
+
+def _attach_geometry(geom_name, n_vertices, n_parts):
+    attached = _geoms.get(geom_name)
+    if attached is None:
+        shm = shared_memory.SharedMemory(name=geom_name)
+        attached = _geoms[geom_name] = (shm, SharedGeometry(shm.buf, n_vertices, n_parts))
+    return attached[1]
+
+
+def _render_band(geom_share, fb_name, cell_w, cell_h, col0, row0, w, h, base, sub_rows):
+    geom = _attach_geometry(*geom_share)
+    shm = _fb_shm.get(fb_name)
+    if shm is None:
+        # A new framebuffer means the old one is gone
+        for old in _fb_shm.values():
+            old.close()
+        _fb_shm.clear()
+        shm = shared_memory.SharedMemory(name=fb_name)
+        _fb_shm[fb_name] = shm
+    out = shm.buf[base*4:(base + w*h)*4].cast('i')
+    rasterize(geom, cell_w, cell_h, col0, row0, w, h, out, sub_rows=sub_rows)
+    out.release()
+
+
+class BandRenderer:
+    def __init__(self, geom, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        # More bands than workers so uneven bands (ocean vs. coastline heavy)
+        # even out
+        self.bands = self.workers * 2
+
+        # Level of detail -> (shared memory, vertices, parts), see share()
+        self.geoms = {}
+        self.share(geom)
+
+        self.fb_shm = None
+        self.fb_len = 0
+
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+
+    # Copy geom into shared memory, once per level of detail. Returns what
+    # workers need to find it.
+    def share(self, geom):
+        shared = self.geoms.get(geom.level)
+        if shared is None:
+            n_vertices = len(geom.x)
+            n_parts = len(geom.parts) - 1
+            shm = shared_memory.SharedMemory(create=True, size=geometry_size(n_vertices, n_parts))
+            view = SharedGeometry(shm.buf, n_vertices, n_parts)
+            view.x[:] = geom.x
+            view.y[:] = geom.y
+            view.bbox[:] = geom.bbox
+            view.parts[:] = geom.parts
+            # Views must be released before the memory can be closed
+            for part in (view.x, view.y, view.bbox, view.parts):
+                part.release()
+            shared = self.geoms[geom.level] = (shm, n_vertices, n_parts)
+        (shm, n_vertices, n_parts) = shared
+        return (shm.name, n_vertices, n_parts)
+
+    def close(self):
+        self.pool.shutdown()
+        shms = [shm for (shm, n_vertices, n_parts) in self.geoms.values()]
+        for shm in [self.fb_shm] + shms:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+        self.fb_shm = None
+        self.geoms = {}
+
+    # Rasterize geom (any level of detail of the one given to the
+    # constructor) for the w*h cell rectangle at (col0, row0) into out, a
+    # flat row-major array of w*h cells
+    def render(self, geom, cell_w, cell_h, col0, row0, w, h, out, sub_rows=2):
+        geom_share = self.share(geom)
+        n = w*h
+        if self.fb_len != n:
+            if self.fb_shm is not None:
+                self.fb_shm.close()
+                self.fb_shm.unlink()
+            self.fb_shm = shared_memory.SharedMemory(create=True, size=max(4*n, 4))
+            self.fb_len = n
+
+        buf = self.fb_shm.buf
+        buf[:4*n] = bytes(4*n)
+
+        rows = -(-h // self.bands)
+        jobs = []
+        for y in range(0, h, rows):
+            band_h = min(rows, h - y)
+            jobs.append(self.pool.submit(_render_band, geom_share, self.fb_shm.name,
+                cell_w, cell_h, col0, row0 + y, w, band_h, y*w, sub_rows))
+        wait(jobs)
+        for job in jobs:
+            # Raise worker errors here
+            job.result()
+
+        with memoryview(out).cast('B') as dst:
+            dst[:] = buf[:4*n]
@@ -1,12 +1,20 @@
-import random
 import aircraft
+import randomness
 
+# Customer row as read by load() and Database.customers_where()
+COLUMNS = "id, name, origin, destination, reward, deadline, accepted"
+
+# Slotted, an airport's worth of customers is loaded for every menu
 class Customer:
+    __slots__ = ("db", "id", "name", "origin", "destination", "reward", "deadline", "accepted")
+
     def __init__(self, db):
-        self.name = f"Customer{random.randint(1000, 9999)}"
+        self.name = f"Customer{randomness.source.randint(1000, 9999)}"
         self.db = db
 
         self.id = 0
+        self.origin      = None
+        self.destination = None
 
         self.deadline = 0
         self.reward   = 0
@@ -26,42 +34,24 @@ class Customer:
 
 
 
-    def generate_tier1(self, origin_icao):
-        exitLoop = False
-        while not exitLoop:
-            self.origin = origin_icao
-            cur = self.db.con.cursor()
-            query = f"SELECT ident FROM airport WHERE type IN ('small_airport', 'medium_airport') AND iso_country='FI' AND ident != ? ORDER BY RAND() LIMIT 1"
-            cur.execute(query, (origin_icao,))
-            result = cur.fetchone()
-            #Calculate distance
-            distance = self.db.icao_distance(origin_icao,result[0])
-            if distance > aircraft.get_aircraft_range(self.db.con, aircraft.get_selected_aircraft()):
-                continue
-
-
-            self.destination = result[0]
-            self.reward = aircraft.get_payout(distance, aircraft.get_fuel_burn_per_km(self.db.con, aircraft.get_selected_aircraft()), aircraft.get_aircraft_type(self.db.con, aircraft.get_selected_aircraft()))
-            exitLoop = True
+    # Pick a destination and reward for a customer waiting at origin_icao.
+    # Returns False if there's no destination within the aircraft's range.
+    def generate_tier1(self, origin_icao, airports):
+        return self.generate(origin_icao, 1, airports)
 
+    def generate_tier2(self, origin_icao, airports):
+        return self.generate(origin_icao, 2, airports)
 
-    def generate_tier2(self, origin_icao):
-        exitLoop = False
-        while not exitLoop:
-            self.origin = origin_icao
-            cur = self.db.con.cursor()
-            query = f"SELECT ident FROM airport WHERE type IN ('large_airport', 'medium_airport') AND ident != ? ORDER BY RAND() LIMIT 1"
-            cur.execute(query, (origin_icao,))
-            result = cur.fetchone()
+    def generate(self, origin_icao, tier, airports):
+        stats = aircraft.get_stats(self.db.con, self.db.selected_aircraft)
+        offer = generate_offer(airports, origin_icao, tier, stats)
+        if offer is None:
+            return False
 
-            #Calculate distance
-            distance = self.db.icao_distance(origin_icao,result[0])
-            if distance > aircraft.get_aircraft_range(self.db.con, aircraft.get_selected_aircraft()):
-                continue
+        self.origin = origin_icao
+        self.destination, distance, self.reward = offer
+        return True
 
-            self.destination = result[0]
-            self.reward = aircraft.get_payout(distance, aircraft.get_fuel_burn_per_km(self.db.con, aircraft.get_selected_aircraft()), aircraft.get_aircraft_type(self.db.con, aircraft.get_selected_aircraft()))
-            exitLoop = True
 
     def accept(self):
         cur = self.db.con.cursor()
@@ -69,11 +59,20 @@ class Customer:
         cur.execute(query, (self.id,))
 
         self.accepted = 1
+        if self.db.store is not None:
+            self.db.store.set_accepted(self.id)
+        self.db.customers_changed()
 
 
 
 
     def save(self):
+        store = self.db.store
+        # Rows added in bulk take ids first, the table must have them before
+        # it hands out the next one
+        if store is not None:
+            store.flush(self.db)
+
         cur = self.db.con.cursor()
         query = """
             INSERT INTO customer (
@@ -95,28 +94,27 @@ class Customer:
                 self.accepted
             )
         )
+        self.id = cur.lastrowid
+        if store is not None:
+            store.append(self)
+        self.db.customers_changed()
 
 
     def drop(self):
         cur = self.db.con.cursor()
         cur.execute("DELETE FROM customer WHERE id = ?", (self.id,))
+        if self.db.store is not None:
+            self.db.store.remove(self.id)
+        self.db.customers_changed()
 
     def load(self, customer_id):
         cur = self.db.con.cursor()
-        query = """
-            SELECT
-                id,
-                name,
-                origin,
-                destination,
-                reward,
-                deadline,
-                accepted
-            FROM customer WHERE id = ?;
-        """
+        query = f"SELECT {COLUMNS} FROM customer WHERE id = ?;"
         cur.execute(query, (customer_id,))
-        result = cur.fetchone()
+        self.set_row(cur.fetchone())
 
+    # Fill in from a row of COLUMNS
+    def set_row(self, result):
         self.id          = result[0]
         self.name        = result[1]
         self.origin      = result[2]
@@ -126,4 +124,73 @@ class Customer:
         self.accepted    = result[6]
 
 
-
+# Customer generation rules, shared by the game and the economy simulator
+# (sim.py). Nothing here touches the database.
+
+# Where customers of each tier want to go
+TIER_DESTINATIONS = {
+    1: (("small_airport", "medium_airport"), "FI"),
+    2: (("large_airport", "medium_airport"), None),
+}
+
+# How many customers of each tier an airport gets
+def customer_counts(airport_type, aircraft_type):
+    customers_tier1 = 1 # Small airports always have one customer
+    customers_tier2 = 0
+    match airport_type:
+        case "medium_airport":
+            customers_tier1 = 3
+            customers_tier2 = 0
+        case "large_airport":
+            customers_tier1 = 2
+            customers_tier2 = 3
+
+    if (aircraft_type == "Small"):
+        customers_tier2 = 0 # Small aircraft can't take large airport customers
+
+    return customers_tier1, customers_tier2
+
+# Random destination within range of the aircraft (stats as returned by
+# aircraft.get_stats()), with its distance and reward. None if nothing is in
+# range.
+def generate_offer(airports, origin_icao, tier, stats, rng=None):
+    if rng is None:
+        rng = randomness.source
+    (types, country) = TIER_DESTINATIONS[tier]
+    rows = airports.where(types, country)
+    distance = airports.distances(origin_icao, rows)
+
+    candidates = ((distance <= stats["range_km"]) & (rows != airports.rows[origin_icao])).nonzero()[0]
+    if len(candidates) == 0:
+        return None
+
+    pick = candidates[rng.randrange(len(candidates))]
+    km = float(distance[pick])
+    reward = aircraft.get_payout(km, stats["fuel_consumption_lph"], stats["category"], rng)
+    return (airports.ident[rows[pick]], km, reward)
+
+
+# Check customers at airport, generate them if necessary
+def populate_airport(db, icao, airports):
+    if icao not in airports:
+        return
+
+    customers = db.customers_from_airport(icao)
+
+    if (len(customers) > 0):
+        return
+
+    # Make sure airport has at least N customers
+    airport_type = airports.type[airports.rows[icao]]
+    aircraft_type = aircraft.get_aircraft_type(db.con, db.selected_aircraft)
+    customers_tier1, customers_tier2 = customer_counts(airport_type, aircraft_type)
+
+    for i in range(0, customers_tier1):
+        customer = Customer(db)
+        if customer.generate_tier1(icao, airports):
+            customer.save()
+
+    for i in range(0, customers_tier2):
+        customer = Customer(db)
+        if customer.generate_tier2(icao, airports):
+            customer.save()
@@ -1,39 +1,117 @@
 import mariadb
-from geopy.distance import great_circle
-from geopy.distance import geodesic
 
-from customer import Customer
-
-# Change this value to cause database to reset
-SCHEMA_VERSION = "7"
+import aircraft
+from customer import Customer, COLUMNS as CUSTOMER_COLUMNS
+from events import AircraftSelected, CustomersChanged, QuestFlagChanged
+
+# Schema versions
+#
+# reset() creates the tables as they were at BASELINE_VERSION. Every change
+# after that is a migration below, applied in order on startup, so existing
+# saves keep their customers, quest flags and owned aircraft. To change the
+# schema, append a migration; don't edit reset() or old migrations.
+#
+# Databases older than the baseline (from before migrations existed) are
+# still reset.
+BASELINE_VERSION = 7
+
+MIGRATIONS = [
+    # 8: Secondary indexes for the lookups done all the time. See
+    # HOT_QUERIES for which query uses which.
+    (8, [
+        "CREATE INDEX IF NOT EXISTS customer_origin   ON customer (origin)",
+        "CREATE INDEX IF NOT EXISTS customer_accepted ON customer (accepted)",
+        "CREATE INDEX IF NOT EXISTS airport_type      ON airport (type)",
+        "CREATE INDEX IF NOT EXISTS airport_country   ON airport (iso_country, type)",
+        "CREATE INDEX IF NOT EXISTS aircraft_name     ON aircraft (name)",
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0] if MIGRATIONS else BASELINE_VERSION
+
+# Queries that run often enough to need an index, with the index they should
+# use. check_indexes() runs EXPLAIN on them.
+HOT_QUERIES = [
+    (f"SELECT {CUSTOMER_COLUMNS} FROM customer WHERE origin = ? ORDER BY id", ("EFHK",), "customer_origin"),
+    (f"SELECT {CUSTOMER_COLUMNS} FROM customer WHERE accepted = 1 ORDER BY id", (), "customer_accepted"),
+    ("SELECT ident FROM airport WHERE type IN ('small_airport', 'medium_airport', 'large_airport')", (), "airport_type"),
+    ("SELECT ident FROM airport WHERE iso_country = ? AND type IN ('small_airport', 'medium_airport')", ("FI",), "airport_country"),
+    ("SELECT range_km FROM aircraft WHERE name = ?", ("Cessna 208 Caravan",), "aircraft_name"),
+]
+
+# Loader threads open their own connections with this, a connection must not
+# be shared between threads.
+def connect():
+    return mariadb.connect(
+        host='127.0.0.1',
+        port=3306,
+        database='flight_game',
+        user='metropolia',
+        password='metropolia',
+        autocommit=True
+    )
+
+# Tables holding one player's progress, see isolate()
+PLAYER_TABLES = ("customer", "quest", "aircraft")
 
 class Database():
     def __init__(self):
-        self.con = mariadb.connect(
-            host='127.0.0.1',
-            port=3306,
-            database='flight_game',
-            user='metropolia',
-            password='metropolia',
-            autocommit=True
-        )
-
-        # Reset the database if metadata is missing or schema is wrong version
+        self.con = connect()
+
+        # Per player, like the tables in PLAYER_TABLES
+        self.selected_aircraft = aircraft.selected_aircraft
+        # True if this connection has its own copy of the player tables
+        self.isolated = False
+        # EventBus of the game using this connection, see events.py. None for
+        # connections no game is watching, eg. the prefetcher's.
+        self.events = None
+        # In-memory copy of the customer table, see load_demand()
+        self.store = None
+
+        # Reset the database if metadata is missing or the schema is too old
+        # or too new to migrate, otherwise bring it up to date
         try:
-            version = self.metadata_get("schema")
-            if (version != SCHEMA_VERSION):
-                self.reset()
-        except:
+            version = int(self.metadata_get("schema"))
+        except (mariadb.Error, TypeError, ValueError):
+            version = None
+
+        if version is None or version < BASELINE_VERSION or version > SCHEMA_VERSION:
             self.reset()
+        else:
+            self.migrate(version)
 
         # Reset anyway for now
         #self.reset()
 
 
+    # Give this connection its own empty copies of the player tables, for
+    # server sessions (see server.py). They are TEMPORARY tables that shadow
+    # the real ones, so every query works unchanged, sees only this player's
+    # rows, and nothing is left behind when the connection closes.
+    def isolate(self):
+        cur = self.con.cursor()
+        for table in PLAYER_TABLES:
+            cur.execute(f"DROP TEMPORARY TABLE IF EXISTS {table}")
+        for table in PLAYER_TABLES:
+            cur.execute(f"CREATE TEMPORARY TABLE {table} LIKE {table}")
+        cur.executemany(
+            "INSERT INTO aircraft (" + ", ".join(aircraft.COLUMNS) + ") VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+            aircraft.CATALOG)
+        self.select_aircraft(aircraft.selected_aircraft)
+        self.isolated = True
+        self.store = None
+        self.customers_changed()
+        self.publish(QuestFlagChanged(None))
+
      # Write the database schema here !!!
     def reset(self):
         #print("Resetting database")
 
+        # Only reset this player, the shared tables belong to everyone
+        if self.isolated:
+            self.isolate()
+            return
+
         cur = self.con.cursor()
         cur.execute("DROP TABLE IF EXISTS metadata;")
         cur.execute("""
@@ -90,17 +168,46 @@ class Database():
             owned INT DEFAULT 0
         );""")
 
-        cur.execute("""
-        INSERT INTO aircraft (id, name, category, capacity, speed_kmh, range_km, fuel_tank_l, fuel_consumption_lph, co2_emissions_kgph, price_million, owned) VALUES
-        (1, 'Cessna 208 Caravan', 'Small', 9, 340, 1700, 1300, 220, 560, 3.00, 1),
-        (2, 'DHC-6 Twin Otter', 'Medium', 19, 330, 1500, 2000, 400, 1000, 5.00, 0),
-        (3, 'Learjet 75', 'Medium', 12, 860, 3700, 6000, 700, 1900, 5.25, 0),
-        (4, 'Boeing 747-8', 'Large', 400, 920, 14000, 240000, 12000, 30000, 250.00, 0),
-        (5, 'Boeing 747-8 VIP', 'Large', 50, 920, 14000, 240000, 12000, 30000, 250.00, 0);
-        """)
+        cur.executemany(
+            "INSERT INTO aircraft (" + ", ".join(aircraft.COLUMNS) + ") VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+            aircraft.CATALOG)
+        self.store = None
+        self.customers_changed()
+        self.publish(QuestFlagChanged(None))
+
+        # THESE MUST BE THE LAST LINES OF THIS FUNCTION
+        self.metadata_set("schema", str(BASELINE_VERSION))
+        self.migrate(BASELINE_VERSION)
 
-        # THIS MUST BE THE LAST LINE OF THIS FUNCTION
-        self.metadata_set("schema", SCHEMA_VERSION)
+    # Apply the migrations newer than version, recording each one as it's
+    # done so an interrupted run picks up where it left off
+    def migrate(self, version):
+        cur = self.con.cursor()
+        for (target, statements) in MIGRATIONS:
+            if target <= version:
+                continue
+            for statement in statements:
+                cur.execute(statement)
+            self.metadata_set("schema", str(target))
+
+    # EXPLAIN every query in HOT_QUERIES, returns a line of text per query.
+    # The optimizer may skip an index on a nearly empty table, so that's
+    # only reported; an index that can't be used at all is an error.
+    def check_indexes(self):
+        cur = self.con.cursor(dictionary=True)
+        lines = []
+        for (query, params, index) in HOT_QUERIES:
+            cur.execute("EXPLAIN " + query, params)
+            plan = cur.fetchall()[0]
+            possible = (plan["possible_keys"] or "").split(",")
+            if plan["key"] == index:
+                status = "ok"
+            elif index in possible:
+                status = f"not chosen ({plan['key'] or plan['type']}, {plan['rows']} rows)"
+            else:
+                status = "MISSING"
+            lines.append(f"{index:20} {status}")
+        return lines
 
 
     def metadata_get(self, key):
@@ -123,6 +230,8 @@ class Database():
         return True
 
     def icao_distance(self, icao_a, icao_b):
+        # geopy is slow to import, only pay for it when first needed
+        from geopy.distance import geodesic
         a = self.airport_yx_icao(icao_a);
         b = self.airport_yx_icao(icao_b);
         return geodesic(a, b).km
@@ -178,35 +287,78 @@ class Database():
         return [coords[0],coords[1]]
 
 
-    def customers_from_airport(self, icao):
+    def publish(self, event):
+        if self.events is not None:
+            self.events.publish(event)
+
+    def customers_changed(self):
+        self.publish(CustomersChanged())
+
+    def select_aircraft(self, name):
+        self.selected_aircraft = name
+        self.publish(AircraftSelected(name))
+
+    # Customers matching an SQL condition, read in one query
+    def customers_where(self, condition, params=()):
         cur = self.con.cursor()
-        query = f"SELECT id FROM customer WHERE origin = ?"
-        cur.execute(query, (icao,))
+        query = f"SELECT {CUSTOMER_COLUMNS} FROM customer WHERE {condition} ORDER BY id"
+        cur.execute(query, params)
         result = cur.fetchall()
 
         customers = []
 
-        for (customer_id,) in result:
+        for row in result:
             c = Customer(self)
-            c.load(customer_id)
+            c.set_row(row)
             customers.append(c)
 
         return customers
 
-    def accepted_customers(self):
+    # (id, accepted) of every customer at icao, without building Customer
+    # objects: those draw a random name, which would move the game's RNG
+    def customer_states(self, icao):
+        if self.store is not None:
+            rows = self.store.rows()[self.store.at(icao)]
+            return tuple(zip(rows["id"].tolist(), rows["accepted"].tolist()))
         cur = self.con.cursor()
-        query = f"SELECT id FROM customer WHERE accepted = 1"
-        cur.execute(query, )
-        result = cur.fetchall()
-
-        customers = []
+        cur.execute("SELECT id, accepted FROM customer WHERE origin = ? ORDER BY id", (icao,))
+        return tuple(tuple(row) for row in cur.fetchall())
 
-        for (customer_id,) in result:
-            c = Customer(self)
-            c.load(customer_id)
-            customers.append(c)
+    def customers_from_airport(self, icao):
+        if self.store is not None:
+            return self.store.customers(self, self.store.at(icao))
+        return self.customers_where("origin = ?", (icao,))
 
-        return customers
+    def accepted_customers(self):
+        if self.store is not None:
+            return self.store.customers(self, self.store.select(accepted=1))
+        return self.customers_where("accepted = 1")
+
+    # The customer table as a CustomerStore (see demand.py), for
+    # airports (an AirportIndex)
+    def open_store(self, airports):
+        from demand import CustomerStore
+        store = CustomerStore(airports)
+        store.load(self)
+        return store
+
+    # Add rows (generated offers, see demand.py) to store, write them to the
+    # table and keep all customers in memory from now on
+    def use_store(self, store, rows=()):
+        if len(rows):
+            store.extend(rows)
+        store.flush(self)
+        self.store = store
+        self.customers_changed()
+
+    # Give every airport in airports customers of its own, see use_store().
+    # Returns the number of customers added.
+    def load_demand(self, airports):
+        from demand import generate_world
+        store = self.open_store(airports)
+        added = generate_world(store, aircraft.get_stats(self.con, self.selected_aircraft))
+        self.use_store(store)
+        return added
     
     def get_all_aircraft(self):
         cur = self.con.cursor()
@@ -219,3 +371,6 @@ class Database():
     def kill_all_customers(self):
         cur = self.con.cursor()
         cur.execute("DELETE FROM customer")
+        if self.store is not None:
+            self.store.clear()
+        self.customers_changed()
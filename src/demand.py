@@ -0,0 +1,432 @@
+# Demand.py
+
+# Customers for the whole world, kept in memory as columns.
+#
+# The customer table was designed for a handful of customers per airport,
+# generated when the player lands and read back one airport at a time.
+# CustomerStore keeps every customer in one NumPy structured array instead,
+# so filtering, sorting by reward and per-airport totals over hundreds of
+# thousands of offers are single vectorized operations, and
+# generate_world() fills every airport at once.
+#
+# The store mirrors the customer table. load() reads the table in one query.
+# Changes made through Customer (save, accept, drop) go to both, and rows
+# added in bulk are written with flush() in batches. Once a Database has a
+# store (Database.load_demand()), customer lists come from it and never hit
+# the table.
+#
+# Airports are stored as indexes into codes, which starts out as the rows of
+# the AirportIndex (airports.py); airports the index doesn't have are added
+# at the end as they turn up.
+
+import numpy as np
+
+import aircraft
+import randomness
+from airports import EARTH_RADIUS_KM
+from customer import Customer, TIER_DESTINATIONS, COLUMNS, customer_counts
+
+# Rows per INSERT in flush()
+BATCH = 5000
+
+# Random draws at finding an in-range destination for each customer before
+# the rest are picked exactly, see generate_offers()
+ROUNDS = 16
+
+# Entries per distance matrix block, see in_range()
+MATRIX_CELLS = 1 << 21
+
+DTYPE = np.dtype([
+    ("id",          np.int64),
+    ("name",        "S40"),
+    ("origin",      np.int32),
+    ("destination", np.int32),
+    ("reward",      np.int64),
+    ("deadline",    np.int32),
+    ("accepted",    np.int8),
+    # Not in the database yet, see flush()
+    ("unsaved",     np.int8),
+])
+
+
+class CustomerStore:
+    def __init__(self, airports):
+        self.airports = airports
+        self.codes = list(airports.ident)
+        self.code_rows = dict(airports.rows)
+
+        self.data = np.zeros(1024, dtype=DTYPE)
+        self.n = 0
+        # Ids for rows added in bulk, above anything in the table
+        self.next_id = 1
+
+        # Rows sorted by origin and where each origin starts, see at()
+        self.order = None
+        self.starts = None
+
+    def __len__(self):
+        return self.n
+
+    def rows(self):
+        return self.data[:self.n]
+
+    def code(self, icao):
+        k = self.code_rows.get(icao)
+        if k is None:
+            k = self.code_rows[icao] = len(self.codes)
+            self.codes.append(icao)
+        return k
+
+    # Room for count more rows
+    def reserve(self, count):
+        if self.n + count > len(self.data):
+            grown = np.zeros(max(self.n + count, 2 * len(self.data)), dtype=DTYPE)
+            grown[:self.n] = self.data[:self.n]
+            self.data = grown
+
+    def changed(self):
+        self.order = None
+        self.starts = None
+
+    # Add rows from an array of DTYPE, ids are filled in
+    def extend(self, rows):
+        count = len(rows)
+        self.reserve(count)
+        rows["id"] = np.arange(self.next_id, self.next_id + count)
+        rows["unsaved"] = 1
+        self.data[self.n:self.n+count] = rows
+        self.n += count
+        self.next_id += count
+        self.changed()
+
+    # A customer Customer.save() just inserted
+    def append(self, customer):
+        self.reserve(1)
+        row = self.data[self.n]
+        row["id"] = customer.id
+        row["name"] = customer.name.encode()
+        row["origin"] = self.code(customer.origin)
+        row["destination"] = self.code(customer.destination)
+        row["reward"] = customer.reward
+        row["deadline"] = customer.deadline
+        row["accepted"] = customer.accepted
+        row["unsaved"] = 0
+        self.n += 1
+        self.next_id = max(self.next_id, customer.id + 1)
+        self.changed()
+
+    def find(self, customer_id):
+        return np.flatnonzero(self.rows()["id"] == customer_id)
+
+    def set_accepted(self, customer_id):
+        self.data["accepted"][self.find(customer_id)] = 1
+
+    def remove(self, customer_id):
+        keep = self.rows()["id"] != customer_id
+        count = int(keep.sum())
+        self.data[:count] = self.rows()[keep]
+        self.n = count
+        self.changed()
+
+    def clear(self):
+        self.n = 0
+        self.changed()
+
+    # Queries, all return row numbers
+
+    # Customers waiting at icao, oldest first
+    def at(self, icao):
+        k = self.code_rows.get(icao)
+        if k is None or self.n == 0:
+            return np.zeros(0, dtype=np.int64)
+        if self.order is None:
+            origin = self.rows()["origin"]
+            self.order = np.argsort(origin, kind="stable")
+            counts = np.bincount(origin, minlength=len(self.codes))
+            self.starts = np.concatenate(([0], np.cumsum(counts)))
+        if k + 1 >= len(self.starts):
+            return np.zeros(0, dtype=np.int64)
+        return self.order[self.starts[k]:self.starts[k+1]]
+
+    # Rows matching every condition given
+    def select(self, origin=None, destination=None, accepted=None, min_reward=None):
+        if origin is not None:
+            rows = self.at(origin)
+        else:
+            rows = np.arange(self.n)
+        data = self.data
+        mask = np.ones(len(rows), dtype=bool)
+        if destination is not None:
+            mask &= data["destination"][rows] == self.code_rows.get(destination, -1)
+        if accepted is not None:
+            mask &= data["accepted"][rows] == accepted
+        if min_reward is not None:
+            mask &= data["reward"][rows] >= min_reward
+        return rows[mask]
+
+    # The count best paying of rows, best first
+    def top_by_reward(self, rows, count):
+        rewards = self.data["reward"][rows]
+        if len(rows) > count:
+            best = np.argpartition(-rewards, count)[:count]
+            rows = rows[best]
+            rewards = rewards[best]
+        return rows[np.argsort(-rewards, kind="stable")]
+
+    # Per airport (indexes into codes): number of customers and their total
+    # reward
+    def totals_by_origin(self, rows=None):
+        if rows is None:
+            rows = np.arange(self.n)
+        origin = self.data["origin"][rows]
+        counts = np.bincount(origin, minlength=len(self.codes))
+        rewards = np.bincount(origin, weights=self.data["reward"][rows], minlength=len(self.codes))
+        return counts, rewards
+
+    # Customer objects for rows, for the menus
+    def customers(self, db, rows):
+        data = self.data
+        customers = []
+        for i in rows:
+            row = data[i]
+            c = Customer(db)
+            c.set_row((
+                int(row["id"]), row["name"].decode(),
+                self.codes[row["origin"]], self.codes[row["destination"]],
+                int(row["reward"]), int(row["deadline"]), int(row["accepted"]),
+            ))
+            customers.append(c)
+        return customers
+
+    # Database side
+
+    # Replace the contents with the customer table
+    def load(self, db):
+        cur = db.con.cursor()
+        cur.execute(f"SELECT {COLUMNS} FROM customer ORDER BY id")
+        result = cur.fetchall()
+
+        self.clear()
+        self.reserve(len(result))
+        rows = self.data[:len(result)]
+        for (i, (customer_id, name, origin, destination, reward, deadline, accepted)) in enumerate(result):
+            rows[i] = (customer_id, name.encode(), self.code(origin), self.code(destination),
+                reward, deadline, accepted, 0)
+        self.n = len(result)
+        if self.n:
+            self.next_id = int(rows["id"].max()) + 1
+        self.changed()
+
+    # Write rows added with extend() to the table, BATCH rows per statement
+    def flush(self, db):
+        rows = np.flatnonzero(self.rows()["unsaved"])
+        cur = db.con.cursor()
+        query = f"INSERT INTO customer ({COLUMNS}) VALUES (?,?,?,?,?,?,?)"
+        codes = self.codes
+        for start in range(0, len(rows), BATCH):
+            batch = self.data[rows[start:start+BATCH]]
+            # Column by column, much faster than going through numpy rows
+            cur.executemany(query, list(zip(
+                batch["id"].tolist(),
+                [name.decode() for name in batch["name"].tolist()],
+                [codes[k] for k in batch["origin"].tolist()],
+                [codes[k] for k in batch["destination"].tolist()],
+                batch["reward"].tolist(),
+                batch["deadline"].tolist(),
+                batch["accepted"].tolist(),
+            )))
+        self.data["unsaved"][rows] = 0
+        return len(rows)
+
+
+# Customers of tier each of origins gets, see customer_counts()
+def tier_counts(airports, origins, tier, stats):
+    per_type = {}
+    counts = np.zeros(len(origins), dtype=np.int64)
+    for (i, row) in enumerate(origins):
+        kind = airports.type[row]
+        if kind not in per_type:
+            per_type[kind] = customer_counts(kind, stats["category"])[tier-1]
+        counts[i] = per_type[kind]
+    return counts
+
+
+# Distances from rows to candidates and which are destinations in range_km,
+# like generate_offer() works them out. Yields (start, km, ok) a block of
+# rows at a time, so the matrices stay small; km and ok have a row per
+# rows[start:start+len(km)].
+def in_range(airports, rows, candidates, range_km):
+    block = max(1, MATRIX_CELLS // max(len(candidates), 1))
+    for start in range(0, len(rows), block):
+        part = rows[start:start+block]
+        dots = airports.unit[part] @ airports.unit[candidates].T
+        km = EARTH_RADIUS_KM * np.arccos(np.clip(dots, -1.0, 1.0))
+        ok = (km <= range_km) & (candidates[None, :] != part[:, None])
+        yield start, km, ok
+
+
+# Customers for the airports (rows of the AirportIndex) in origins, by the
+# same rules as populate_airport() in customer.py, as an array of DTYPE
+# without ids. rng is a numpy.random.Generator.
+#
+# Destinations are drawn for all customers of a tier at once: a random
+# candidate each, redrawn for the ones out of range, up to ROUNDS times.
+# That settles most of them. The ones left have few destinations in range,
+# eg. Finnish tier 1 customers far from Finland; they pick among the
+# candidates in range of their origin. Either way the pick is uniform over
+# the destinations in range, and customers with none are left out, like
+# when generate_offer() finds nothing.
+def generate_offers(airports, origins, stats, rng):
+    offers = []
+    for tier in (1, 2):
+        counts = tier_counts(airports, origins, tier, stats)
+        tier_origins = np.repeat(origins, counts)
+
+        (types, country) = TIER_DESTINATIONS[tier]
+        candidates = airports.where(types, country)
+        if len(tier_origins) == 0 or len(candidates) == 0:
+            continue
+
+        destinations = np.full(len(tier_origins), -1, dtype=np.int64)
+        distances = np.zeros(len(tier_origins))
+        todo = np.arange(len(tier_origins))
+        for attempt in range(ROUNDS):
+            pick = candidates[rng.integers(len(candidates), size=len(todo))]
+            dots = np.einsum("ij,ij->i", airports.unit[tier_origins[todo]], airports.unit[pick])
+            km = EARTH_RADIUS_KM * np.arccos(np.clip(dots, -1.0, 1.0))
+            ok = (km <= stats["range_km"]) & (pick != tier_origins[todo])
+            destinations[todo[ok]] = pick[ok]
+            distances[todo[ok]] = km[ok]
+            todo = todo[~ok]
+            if len(todo) == 0:
+                break
+
+        if len(todo):
+            pick_in_range(airports, tier_origins, todo, candidates, stats["range_km"], rng,
+                destinations, distances)
+
+        found = destinations >= 0
+        count = int(found.sum())
+        rows = np.zeros(count, dtype=DTYPE)
+        rows["origin"] = tier_origins[found]
+        rows["destination"] = destinations[found]
+        rows["reward"] = aircraft.get_payouts(distances[found], stats["fuel_consumption_lph"], stats["category"], rng)
+        names = rng.integers(1000, 10000, size=count)
+        rows["name"] = np.char.add(b"Customer", names.astype("S4"))
+        offers.append(rows)
+
+    if not offers:
+        return np.zeros(0, dtype=DTYPE)
+    return np.concatenate(offers)
+
+
+# For the customers todo (indexes into origins) pick a destination among
+# candidates in range of their origin, into destinations and distances
+def pick_in_range(airports, origins, todo, candidates, range_km, rng, destinations, distances):
+    (rows, which) = np.unique(origins[todo], return_inverse=True)
+    for (start, km, ok) in in_range(airports, rows, candidates, range_km):
+        mine = np.flatnonzero((which >= start) & (which < start + len(km)))
+        block = which[mine] - start
+        counts = ok.sum(axis=1)[block]
+        mine = mine[counts > 0]
+        block = block[counts > 0]
+        # The k:th candidate in range, k drawn for each customer
+        k = rng.integers(counts[counts > 0])
+        pick = (np.cumsum(ok, axis=1)[block] > k[:, None]).argmax(axis=1)
+        destinations[todo[mine]] = candidates[pick]
+        distances[todo[mine]] = km[block, pick]
+
+
+# How many customers populate_airport() would give each of origins: the
+# numbers from customer_counts(), for tiers with a destination in range.
+# For checking generate_offers().
+def expected_counts(airports, origins, stats):
+    expected = np.zeros(len(origins), dtype=np.int64)
+    for tier in (1, 2):
+        counts = tier_counts(airports, origins, tier, stats)
+        (types, country) = TIER_DESTINATIONS[tier]
+        candidates = airports.where(types, country)
+        if len(candidates) == 0:
+            continue
+        for (start, km, ok) in in_range(airports, origins, candidates, stats["range_km"]):
+            end = start + len(km)
+            expected[start:end] += np.where(ok.any(axis=1), counts[start:end], 0)
+    return expected
+
+
+# Check the store against expected_counts(): airports with customers, none
+# of them accepted yet, whose number of customers is off. Returns the number
+# of airports checked and the rows of the ones that are off.
+def count_mismatches(store, stats):
+    airports = store.airports
+    totals = store.totals_by_origin()[0][:len(airports)]
+    accepted = store.totals_by_origin(store.select(accepted=1))[0][:len(airports)]
+    origins = np.flatnonzero((totals > 0) & (accepted == 0))
+    off = totals[origins] != expected_counts(airports, origins, stats)
+    return len(origins), origins[off]
+
+
+# Airports of the given types (all if None) with no customers in the store
+def empty_airports(store, types=None):
+    airports = store.airports
+    waiting = store.totals_by_origin()[0][:len(airports)]
+    if types is None:
+        return np.flatnonzero(waiting == 0)
+    rows = airports.where(tuple(types))
+    return rows[waiting[rows] == 0]
+
+
+# Customers for every airport in the index that has none, added to the
+# store. Returns the number added.
+def generate_world(store, stats, rng=None):
+    if rng is None:
+        # Seeded from the game's generator, so --seed still repeats everything
+        rng = np.random.default_rng(randomness.source.getrandbits(64))
+    rows = generate_offers(store.airports, empty_airports(store), stats, rng)
+    store.extend(rows)
+    return len(rows)
+
+
+# Parallel world seeding
+#
+# seed_world() splits the origins into chunks and generates each on a process
+# pool, the same way sim.py spreads careers. Every chunk has its own
+# generator, derived from the seed and the chunk's number, so the result
+# doesn't depend on how many workers there are.
+
+# Airports per chunk
+CHUNK = 1000
+
+# Fewer origins than this are generated in this process, starting the pool
+# would take longer than the work
+PARALLEL_MIN = 2000
+
+# Worker process state
+_airports = None
+
+
+def _init_worker(airports):
+    global _airports
+    _airports = airports
+
+
+def _generate_chunk(origins, stats, seed, chunk):
+    return generate_offers(_airports, origins, stats, np.random.default_rng([seed, chunk]))
+
+
+# Offers for every airport in origins as one array of DTYPE without ids,
+# ready for CustomerStore.extend()
+def seed_world(airports, origins, stats, seed, workers=None):
+    chunks = [origins[i:i+CHUNK] for i in range(0, len(origins), CHUNK)]
+    if len(origins) < PARALLEL_MIN:
+        _init_worker(airports)
+        results = [_generate_chunk(c, stats, seed, i) for (i, c) in enumerate(chunks)]
+    else:
+        # Only used from here, keep it off the startup path
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(airports,)) as pool:
+            results = list(pool.map(_generate_chunk, chunks,
+                [stats] * len(chunks), [seed] * len(chunks), range(len(chunks))))
+    if not results:
+        return np.zeros(0, dtype=DTYPE)
+    return np.concatenate(results)
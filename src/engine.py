@@ -0,0 +1,167 @@
+# Engine.py
+
+# The asyncio side of the engine loop, see the comment in main.py.
+#
+# Input is polled without blocking and every wait yields to the event loop,
+# so background work (asset loading, database work run with run_blocking(),
+# timers) keeps going while a menu sits waiting for a key. Screens call
+# redraw() to wake whoever is waiting for input, eg. when an asset arrives.
+#
+# All input goes through getch() here, which makes it the place to record a
+# session: every key is logged with its time, and replay.py feeds the log back
+# to a headless game. Replays run on a virtual clock that advances one tick
+# per frame, so animations take the same number of frames every time.
+#
+# Map screens read input with getkeys(), which takes every key already
+# waiting instead of one per frame. Holding down an arrow key queues up key
+# repeats faster than frames can be drawn; applying them all before drawing
+# keeps the view at most a frame behind the keyboard. Keys read together are
+# logged on one line, so replays see the same groups.
+
+import asyncio
+import json
+import time
+from collections import deque
+
+# Render tick, also how often input is polled
+FPS = 60
+TICK = 1.0 / FPS
+
+
+# Version of the recording file format. Version 1 had one key per line.
+RECORDING_VERSION = 2
+
+# Most keys getkeys() takes at once
+MAX_KEYS = 64
+
+
+class Engine:
+    def __init__(self, win, virtual_clock=False):
+        self.win = win
+        self.win.nodelay(True)
+        self.loop = asyncio.get_running_loop()
+
+        self.virtual_clock = virtual_clock
+        self.t_virtual = 0.0
+
+        self.dirty = False
+        self.t_start = self.clock()
+        self.t_frame = self.t_start
+
+        # Open recording file, see record()
+        self.recording = None
+
+        # Keys read but handed back with unget()
+        self.pending = deque()
+
+    # Seconds, use this instead of time.time() for anything that affects
+    # what's drawn
+    def clock(self):
+        if self.virtual_clock:
+            return self.t_virtual
+        return time.perf_counter()
+
+    async def sleep(self, seconds):
+        if self.virtual_clock:
+            self.t_virtual += seconds
+            seconds = 0
+        await asyncio.sleep(seconds)
+
+    # Log every key from now on. The first line of the file is a JSON
+    # header with the RNG seed, whether the world was seeded (see
+    # main.seed_world()) and whether the map was drawn in braille (see
+    # FrameBuffer.set_braille()); then a "seconds keycode..." line per group
+    # of keys read together.
+    def record(self, path, seed, world=False, braille=False):
+        self.recording = open(path, "w")
+        header = {"version": RECORDING_VERSION, "seed": seed, "world": world, "braille": braille}
+        self.recording.write(json.dumps(header) + "\n")
+
+    def close(self):
+        if self.recording is not None:
+            self.recording.close()
+            self.recording = None
+
+    # Wake up getch() so the screen gets drawn again
+    def redraw(self):
+        self.dirty = True
+
+    # Redraw when a concurrent.futures.Future (eg. a loader job) finishes
+    def redraw_when_done(self, future):
+        future.add_done_callback(lambda f: self.loop.call_soon_threadsafe(self.redraw))
+
+    # Wait for the next keypress. Returns -1 if redraw() was called or
+    # timeout (seconds) ran out before a key was pressed.
+    async def getch(self, timeout=None):
+        if self.pending:
+            return self.pending.popleft()
+        keys = await self.wait_keys(timeout, 1)
+        return keys[0] if keys else -1
+
+    # Wait for a keypress like getch(), then take every other key already
+    # waiting too. Returns a list of keys, empty if redraw() was called or
+    # timeout ran out.
+    async def getkeys(self, timeout=None):
+        if self.pending:
+            keys = list(self.pending)
+            self.pending.clear()
+            return keys
+        return await self.wait_keys(timeout, MAX_KEYS)
+
+    # Give keys back, the next getch() or getkeys() returns them first. For
+    # keys read with getkeys() that the screen doesn't handle itself.
+    def unget(self, keys):
+        self.pending.extendleft(reversed(keys))
+
+    async def wait_keys(self, timeout, most):
+        t_end = None if timeout is None else self.clock() + timeout
+        while True:
+            keys = []
+            while len(keys) < most:
+                ch = self.win.getch()
+                if ch == -1:
+                    break
+                keys.append(ch)
+            if keys:
+                if self.recording is not None:
+                    self.recording.write(f"{self.clock() - self.t_start:.4f} {' '.join(map(str, keys))}\n")
+                return keys
+            if self.dirty:
+                self.dirty = False
+                return []
+            if t_end is not None and self.clock() >= t_end:
+                return []
+            await self.sleep(TICK)
+
+    # Sleep until the next render tick. Animations call this once per frame
+    # instead of rendering as fast as possible.
+    async def tick(self):
+        t_next = self.t_frame + TICK
+        now = self.clock()
+        await self.sleep(max(0.0, t_next - now))
+        self.t_frame = max(t_next, now)
+
+    # Await a concurrent.futures.Future, eg. a loader job
+    async def wait(self, future):
+        return await asyncio.wrap_future(future)
+
+    # Run blocking work (database queries and such) on a worker thread while
+    # the event loop keeps running. The caller must not touch the same
+    # database connection until this returns.
+    async def run_blocking(self, fn, *args):
+        return await self.loop.run_in_executor(None, fn, *args)
+
+
+# Read a file written by Engine.record(), returns
+# (header, [(seconds, [keys read together])])
+def load_recording(path):
+    with open(path) as f:
+        header = json.loads(f.readline())
+        if header.get("version") not in (1, RECORDING_VERSION):
+            raise ValueError(f"{path}: unsupported recording version {header.get('version')}")
+        keys = []
+        for line in f:
+            if line.strip():
+                (t, *group) = line.split()
+                keys.append((float(t), [int(ch) for ch in group]))
+    return header, keys
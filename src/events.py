@@ -0,0 +1,106 @@
+# Events.py
+
+# Announcements of game state changes, so caches know when to let go.
+#
+# Whatever changes the airport, the money, the selected aircraft, customers
+# or quest flags publishes one of the events below on the game's EventBus
+# (GameState.events). Caches are Cached values that name the events they
+# depend on and are dropped when one of them is published; nothing has to
+# remember which caches to clear.
+#
+# Audit mode ("python ./src/main.py --audit") checks that the events are
+# enough: a Cached value with a fingerprint (a cheap summary of what it was
+# built from) compares it on every read. If it changed without an event
+# dropping the value, the read was stale; it's logged in EventBus.stale and
+# the value is rebuilt.
+
+from collections import deque
+
+# Events kept for the audit log
+HISTORY = 20
+
+
+class AirportChanged:
+    def __init__(self, icao):
+        self.icao = icao
+
+class MoneyChanged:
+    def __init__(self, money):
+        self.money = money
+
+class AircraftSelected:
+    def __init__(self, name):
+        self.name = name
+
+# Customers generated, accepted or dropped
+class CustomersChanged:
+    pass
+
+# flag is None if all flags changed, eg. on reset
+class QuestFlagChanged:
+    def __init__(self, flag):
+        self.flag = flag
+
+
+class EventBus:
+    def __init__(self, audit=False):
+        self.audit = audit
+        # Event class -> callbacks
+        self.subscribers = {}
+        # Audit mode: recent events and the stale reads found
+        self.history = deque(maxlen=HISTORY)
+        self.stale = []
+
+    def subscribe(self, event_type, callback):
+        self.subscribers.setdefault(event_type, []).append(callback)
+
+    def publish(self, event):
+        if self.audit:
+            self.history.append(type(event).__name__)
+        for callback in self.subscribers.get(type(event), ()):
+            callback(event)
+
+    def flag_stale(self, name):
+        recent = ", ".join(self.history) or "none"
+        self.stale.append(f"Stale read of {name}, recent events: {recent}")
+
+    def report(self):
+        if not self.audit:
+            return ["Audit is off, start with --audit"]
+        if not self.stale:
+            return ["No stale reads"]
+        return self.stale
+
+
+# A value built on demand and kept until one of the given events is published
+class Cached:
+    def __init__(self, bus, name, build, events, fingerprint=None):
+        self.bus = bus
+        self.name = name
+        self.build = build
+        self.fingerprint = fingerprint
+
+        self.valid = False
+        self.value = None
+        # Fingerprint when built, audit mode only
+        self.built_from = None
+
+        for event_type in events:
+            bus.subscribe(event_type, self.invalidate)
+
+    def invalidate(self, event=None):
+        self.valid = False
+        self.value = None
+
+    def get(self):
+        audit = self.bus.audit and self.fingerprint is not None
+        if self.valid and audit and self.fingerprint() != self.built_from:
+            self.bus.flag_stale(self.name)
+            self.invalidate()
+
+        if not self.valid:
+            self.value = self.build()
+            self.valid = True
+            if audit:
+                self.built_from = self.fingerprint()
+        return self.value
@@ -0,0 +1,181 @@
+# Globe.py
+
+# Orthographic projection: the earth seen as a globe from far away.
+#
+# The flat map is rasterized into cached tiles on a fixed grid, which doesn't
+# work for a globe that turns under the camera. Instead every vertex of the
+# map is turned into a unit vector once (see unit_vertices()), and a frame is
+# a single NumPy matrix multiply that rotates all of them to face the camera,
+# followed by dropping what's on the far side and rasterizing the remaining
+# segments, also with NumPy. No per-vertex Python runs per frame, so turning
+# the globe costs about as much as panning the flat map.
+#
+# Unit vectors use the same axes as map.gps_to_usphere(): y is north.
+
+import math
+
+import numpy as np
+
+from map import gps_to_usphere
+
+# Points on the outline of the globe
+LIMB_STEPS = 96
+
+
+# Unit vectors of a MapGeometry's vertices, and the segments between them,
+# built once per geometry
+_unit_cache = {}
+
+def unit_vertices(geom):
+    cached = _unit_cache.get(id(geom))
+    if cached is not None and cached[0] is geom:
+        return cached[1], cached[2]
+
+    # From the source coordinates: the Mercator y is clamped near the poles,
+    # which would put Antarctica's edge on a ring around the south pole
+    x = np.frombuffer(geom.x, dtype=np.float64)
+    lon = np.radians(x - 90.0)
+    lat = np.radians(np.frombuffer(geom.lat, dtype=np.float64))
+    unit = np.column_stack((
+        np.cos(lat) * np.cos(lon),
+        np.sin(lat),
+        np.cos(lat) * np.sin(-lon),
+    ))
+
+    # Vertex i connects to i+1 unless i is the last vertex of its part.
+    # Edges along the antimeridian and to the south pole are where the map
+    # data cuts shapes open to lay them flat (Fiji, Chukotka, Antarctica),
+    # not coastline. The flat map hides them at its edges, the globe has no
+    # edges.
+    parts = np.frombuffer(geom.parts, dtype=np.int32)
+    last = np.zeros(len(x), dtype=bool)
+    last[parts[1:] - 1] = True
+    seam = np.abs(x) == 180.0
+    pole = np.abs(lat) == 0.5 * math.pi
+    last[:-1] |= (seam[:-1] & seam[1:]) | pole[:-1] | pole[1:]
+    starts = np.flatnonzero(~last)
+
+    _unit_cache[id(geom)] = (geom, unit, starts)
+    return unit, starts
+
+
+# Draw line segments given in subpixel coordinates (two subpixels across a
+# cell, sub_rows down) into out, an h x w array of cells like FrameBuffer.map,
+# the way FrameBuffer.line() does.
+# Segments are clipped to the screen first, so long ones cost no more than
+# the part that's visible.
+def rasterize_segments(ax, ay, bx, by, w, h, out, sub_rows=2):
+    sw = 2 * w
+    sh = sub_rows * h
+
+    # Liang-Barsky clipping against 0..sw, 0..sh
+    dx = bx - ax
+    dy = by - ay
+    t0 = np.zeros(len(ax))
+    t1 = np.ones(len(ax))
+    keep = np.ones(len(ax), dtype=bool)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for (p, d, limit) in ((ax, dx, sw), (ay, dy, sh)):
+            still = d == 0
+            keep &= ~still | ((p >= 0) & (p < limit))
+            ta = (0 - p) / d
+            tb = (limit - p) / d
+            t0 = np.where(still, t0, np.maximum(t0, np.minimum(ta, tb)))
+            t1 = np.where(still, t1, np.minimum(t1, np.maximum(ta, tb)))
+    keep &= t0 <= t1
+
+    cx0 = (ax + t0 * dx)[keep]
+    cy0 = (ay + t0 * dy)[keep]
+    cx1 = (ax + t1 * dx)[keep]
+    cy1 = (ay + t1 * dy)[keep]
+
+    # DDA, one sample per subpixel step
+    ddx = np.trunc(cx1 - cx0)
+    ddy = np.trunc(cy1 - cy0)
+    steps = np.maximum(np.abs(ddx), np.abs(ddy)).astype(np.int64)
+    n = steps + 1
+    seg = np.repeat(np.arange(len(steps)), n)
+    i = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    inv = 1.0 / np.maximum(steps, 1)
+    sx = np.concatenate((cx0[seg] + i * (ddx * inv)[seg], cx1))
+    sy = np.concatenate((cy0[seg] + i * (ddy * inv)[seg], cy1))
+
+    sx = np.floor(sx).astype(np.int64)
+    sy = np.floor(sy).astype(np.int64)
+    inside = (sx >= 0) & (sx < sw) & (sy >= 0) & (sy < sh)
+
+    grid = np.zeros((sh, sw), dtype=np.int32)
+    grid[sy[inside], sx[inside]] = 1
+
+    # Subpixel bit is x + 2*y within the cell, see FrameBuffer.write_subpixel()
+    for y in range(sub_rows):
+        for x in range(2):
+            out |= grid[y::sub_rows, x::2] << (x + 2*y)
+
+
+class OrthographicProjection:
+    name = "Globe"
+    flat = False
+
+    def __init__(self):
+        # Rows: east, north and towards the viewer at the camera position
+        self.rotation = np.identity(3)
+        # Globe radius in cells
+        self.rx = 1.0
+        self.ry = 1.0
+        self.w = 1
+        self.h = 1
+        # Subpixel rows per cell, see FrameBuffer.set_braille()
+        self.sub_rows = 2
+
+    def update_clip(self, cam, fb):
+        lon = math.radians(cam.gps[0] - 90.0)
+        forward = np.array(gps_to_usphere(cam.gps))
+        east = np.array([-math.sin(lon), 0.0, -math.cos(lon)])
+        north = np.cross(forward, east)
+        self.rotation = np.array([east, north, forward])
+
+        # Same scale as the flat map at the center of the view: the screen is
+        # 2*zoom degrees tall. Cells are twice as tall as they're wide.
+        self.ry = fb.h / (2.0 * cam.zoom) * (180.0 / math.pi)
+        self.rx = 2.0 * self.ry
+        self.w = fb.w
+        self.h = fb.h
+        self.sub_rows = fb.sub_rows
+        # There's only one globe
+        cam.copies = [0.0]
+
+    def project_gps(self, cam, gps):
+        (x, y, z) = self.rotation @ gps_to_usphere(gps)
+        if z <= 0.0:
+            return None
+        return [
+            0.5 + x * self.rx / self.w,
+            0.5 - y * self.ry / self.h,
+        ]
+
+    # Subpixel coordinates of unit vectors (N x 3), and which face the viewer
+    def project_units(self, units):
+        view = units @ self.rotation.T
+        sx = (0.5 * self.w + view[:, 0] * self.rx) * 2.0
+        sy = (0.5 * self.h - view[:, 1] * self.ry) * self.sub_rows
+        return sx, sy, view[:, 2] > 0.0
+
+    def render(self, cam, fb, geom):
+        unit, starts = unit_vertices(geom)
+        sx, sy, front = self.project_units(unit)
+
+        # Back face culling: only segments with both ends facing us
+        starts = starts[front[starts] & front[starts + 1]]
+
+        # The outline of the globe
+        angle = np.linspace(0.0, 2.0 * math.pi, LIMB_STEPS + 1)
+        lx = (0.5 * fb.w + np.cos(angle) * self.rx) * 2.0
+        ly = (0.5 * fb.h + np.sin(angle) * self.ry) * self.sub_rows
+
+        rasterize_segments(
+            np.concatenate((sx[starts], lx[:-1])),
+            np.concatenate((sy[starts], ly[:-1])),
+            np.concatenate((sx[starts + 1], lx[1:])),
+            np.concatenate((sy[starts + 1], ly[1:])),
+            fb.w, fb.h, fb.map, self.sub_rows)
@@ -0,0 +1,104 @@
+# Headless.py
+
+# Stand-ins for the curses window, for running the game without curses.
+#
+# CellWindow keeps the screen as a grid of characters and attributes; the
+# ANSI backend (ansi.py) and the game server (server.py) draw from it.
+# HeadlessWindow runs the game without a terminal at all (see replay.py):
+# keys come from a list instead of the keyboard, and every refresh() hashes
+# the screen contents so two runs can be compared.
+
+import hashlib
+
+
+class ReplayFinished(Exception):
+    pass
+
+
+class CellWindow:
+    def __init__(self, h, w):
+        self.resize(h, w)
+
+    # Characters and their attributes, blank after a resize
+    def resize(self, h, w):
+        self.h = h
+        self.w = w
+        self.cells = [[" "] * w for y in range(h)]
+        self.attrs = [[0] * w for y in range(h)]
+
+    def getmaxyx(self):
+        return (self.h, self.w)
+
+    # Same as curses.color_pair(), which only works after initscr()
+    def color_pair(self, n):
+        return n << 8
+
+    def addch(self, y, x, ch, attr=0):
+        if 0 <= y < self.h and 0 <= x < self.w:
+            self.cells[y][x] = ch
+            self.attrs[y][x] = attr
+
+    def addstr(self, y, x, text, attr=0):
+        if not 0 <= y < self.h:
+            return
+        for (i, ch) in enumerate(text):
+            if 0 <= x+i < self.w:
+                self.cells[y][x+i] = ch
+                self.attrs[y][x+i] = attr
+
+    def clear(self):
+        for row in self.cells:
+            row[:] = [" "] * self.w
+        for row in self.attrs:
+            row[:] = [0] * self.w
+
+    def refresh(self):
+        pass
+
+    def getch(self):
+        return -1
+
+    def nodelay(self, flag):
+        pass
+
+    def keypad(self, flag):
+        pass
+
+    def idlok(self, flag):
+        pass
+
+
+# keys is a list of groups of keys, as read by Engine.getkeys() when they
+# were recorded
+class HeadlessWindow(CellWindow):
+    def __init__(self, keys, h=50, w=160):
+        super().__init__(h, w)
+        self.keys = [list(group) for group in keys]
+        self.group = 0
+        self.index = 0
+        # Keys returned so far
+        self.next_key = 0
+
+        self.digest = hashlib.sha256()
+        self.frames = 0
+
+    def refresh(self):
+        for row in self.cells:
+            self.digest.update("".join(row).encode())
+        self.frames += 1
+
+    # Next recorded key, or -1 once between groups, where the game found no
+    # more keys waiting. Raises ReplayFinished once they run out, which
+    # unwinds the menu stack.
+    def getch(self):
+        if self.group >= len(self.keys):
+            raise ReplayFinished()
+        group = self.keys[self.group]
+        if self.index >= len(group):
+            self.group += 1
+            self.index = 0
+            return -1
+        ch = group[self.index]
+        self.index += 1
+        self.next_key += 1
+        return ch
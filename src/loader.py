@@ -0,0 +1,93 @@
+# Loader.py
+
+# Startup timing and background asset loading.
+#
+# Startup used to do everything in sequence before the first frame: connect,
+# check the schema, initialize curses, parse the shapefile. Now curses comes
+# up first and the slow assets (map geometry and the airport index) are loaded
+# concurrently on worker threads while the first menu is already on screen.
+# Code that needs an asset before it's ready simply blocks on it; the map
+# renderer instead skips the coastlines until they arrive.
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Keep time-to-first-frame under this many milliseconds
+STARTUP_BUDGET_MS = 250
+
+# Process start is approximated by the first import of this module, main.py
+# imports it before anything else.
+t_start = time.perf_counter()
+
+# (label, milliseconds since start)
+marks = []
+first_frame_ms = None
+
+
+def elapsed_ms():
+    return (time.perf_counter() - t_start) * 1000
+
+
+def mark(label):
+    marks.append((label, elapsed_ms()))
+
+
+# Called by the render code after every refresh, only the first call counts
+def first_frame():
+    global first_frame_ms
+    if first_frame_ms is not None:
+        return
+    first_frame_ms = elapsed_ms()
+    mark("first frame")
+
+
+def over_budget():
+    return first_frame_ms is not None and first_frame_ms > STARTUP_BUDGET_MS
+
+
+def report():
+    lines = [f"{label:20} {ms:8.1f} ms" for (label, ms) in marks]
+    if first_frame_ms is not None:
+        status = "OVER BUDGET" if over_budget() else "ok"
+        lines.append(f"Budget {STARTUP_BUDGET_MS} ms: {status}")
+    return lines
+
+
+def _load_map():
+    from map import load_map
+    geom = load_map()
+    mark("map loaded")
+    return geom
+
+
+def _load_airports():
+    import database
+    from airports import load_airports
+    con = database.connect()
+    try:
+        airports = load_airports(con)
+    finally:
+        con.close()
+    mark("airports loaded")
+    return airports
+
+
+class Assets:
+    def __init__(self):
+        self.pool = ThreadPoolExecutor(max_workers=2)
+        self.map_job = self.pool.submit(_load_map)
+        self.airports_job = self.pool.submit(_load_airports)
+        self.pool.shutdown(wait=False)
+
+    def ready(self):
+        return self.map_job.done() and self.airports_job.done()
+
+    def map_ready(self):
+        return self.map_job.done()
+
+    # These block until the asset has been loaded
+    def map(self):
+        return self.map_job.result()
+
+    def airports(self):
+        return self.airports_job.result()
@@ -1,13 +1,24 @@
+# Imported first so startup timings start as early as possible
+import loader
+
+import argparse
+import asyncio
 import curses
+import sys
 import time
 import database
+import demand
+import randomness
+from engine import Engine
 from map import MapRenderer, Camera, FrameBuffer, compute_geodesic, put_gps_text
 from popup import Popup, impopup
-from customer import Customer
+from customer import Customer, populate_airport
+from prefetch import Prefetcher
+from offers import CustomerOffers
+from events import EventBus, Cached, AirportChanged, MoneyChanged, CustomersChanged, AircraftSelected
+from route import plan_route, route_distance_km, stop_index
 from quest import QuestManager
-
-from geopy.distance import great_circle
-from geopy.distance import geodesic
+from quality import QualityController
 
 import aircraft
 
@@ -21,48 +32,115 @@ import aircraft
 # don't need that complexity here.
 # Arcane procedual programming techniques ;)
 #
+# The stack runs on an asyncio event loop: every screen is a coroutine and
+# every wait for input or for the next frame is an await (see engine.py).
+# Nothing blocks the loop, so asset loading and database work on worker
+# threads carry on while a menu waits for the player, and a screen can be
+# woken up to redraw when they finish.
+#
 
+# Curses color pairs: pair -> (foreground, background)
+COLOR_PAIRS = {
+    1: (15, 0),
+    2: (9, 0),
+    3: (10, 0),
+}
+
+def init_curses():
+    win = curses.initscr()
+    curses.noecho()
+    curses.cbreak()
+    win.keypad(True)
+    # Let curses use the terminal's own scrolling when the map pans
+    # vertically
+    win.idlok(True)
+    win.clear()
+    curses.curs_set(0)
+    curses.start_color()
+    curses.use_default_colors()
+    # Colors
+    for (pair, (fg, bg)) in COLOR_PAIRS.items():
+        curses.init_pair(pair, fg, bg)
+    return win
+
+# win and assets can be passed in to run without a terminal (see replay.py),
+# db and tiles to run several games in one process (see server.py). audit
+# turns on the event bus audit, see events.py.
 class GameState:
-    def __init__(self):
+    def __init__(self, win=None, assets=None, virtual_clock=False, db=None, tiles=None, audit=False):
+
+        # State changes are published here, change these two with
+        # set_money() and set_airport()
+        self.events = EventBus(audit)
 
         # TODO Move these two to the database
-        self.money = 3_950_000
+        self.money = aircraft.START_MONEY
         self.airport = "EFHK"
 
-        self.db = database.Database()
+        if win is None:
+            win = init_curses()
+            loader.mark("curses")
+
+        # Map and airport index load in the background from here on, the
+        # first menu doesn't wait for them.
+        if assets is None:
+            assets = loader.Assets()
+        self.assets = assets
+
+        if db is None:
+            db = database.Database()
+        self.db = db
+        self.db.events = self.events
         #Kill customers
         self.db.kill_all_customers()
+        loader.mark("database")
 
-        # Curses initialization
-        win = curses.initscr()
-        curses.noecho()
-        curses.cbreak()
-        win.keypad(True)
-        win.clear()
-        curses.curs_set(0)
-        curses.start_color()
-        curses.use_default_colors()
-        # Colors
-        curses.init_pair(1, 15, 0)
-        curses.init_pair(2, 9, 0)
-        curses.init_pair(3, 10, 0)
+        pos = self.db.airport_xy_icao(self.airport)
 
-
-        pos = self.db.airport_xy_icao("EFHK")
+        # Replays must draw the same frames however long they take
+        self.quality = QualityController(enabled=not virtual_clock)
 
         fb = FrameBuffer(win)
         cam = Camera()
         cam.gps = pos.copy()
-        gfx = MapRenderer(fb)
+        gfx = MapRenderer(fb, self.assets, tiles, self.quality)
 
         self.cam = cam
         self.gfx = gfx
         self.win = win
 
+        self.engine = Engine(win, virtual_clock)
+        # Draw the map as soon as it has loaded
+        self.engine.redraw_when_done(self.assets.map_job)
+
         self.quests = QuestManager(self)
+        self.prefetch = Prefetcher(self.assets, customers=not self.db.isolated)
 
+        # Reachability per airport and aircraft, see choose_airport_from_map()
+        self.reach = None
 
-    def fly_to(self, icao):
+        # Customers at the current airport, see customer_offers()
+        self.offers = Cached(self.events, "customer offers",
+            lambda: CustomerOffers(self.db, self.assets.airports(), self.airport),
+            (AirportChanged, CustomersChanged),
+            fingerprint=self.offers_fingerprint)
+
+        # Range of the selected aircraft
+        self.aircraft_range = Cached(self.events, "aircraft range",
+            lambda: aircraft.get_aircraft_range(self.db.con, self.db.selected_aircraft),
+            (AircraftSelected,),
+            fingerprint=lambda: self.db.selected_aircraft)
+
+    def set_money(self, money):
+        self.money = money
+        self.events.publish(MoneyChanged(money))
+
+    def set_airport(self, icao):
+        self.airport = icao
+        self.events.publish(AirportChanged(icao))
+
+
+    async def fly_to(self, icao):
         target = icao.upper()
         if not self.db.icao_exists(target):
             return
@@ -76,51 +154,43 @@ class GameState:
         gps_a = self.db.airport_xy_icao(self.airport)
         gps_b = self.db.airport_xy_icao(target)
 
+        # Get the destination ready while the flight animation plays
+        arrival = self.prefetch.start(target, self.db.selected_aircraft,
+            customers=self.db.store is None)
+
         wp = compute_geodesic(gps_a, gps_b)
-        self.animate_travel(wp)
+        await self.animate_travel(wp)
 
-        self.airport = target
-        customers = self.db.customers_from_airport(icao)
+        self.set_airport(target)
 
-        self.quests.arrived_at_airport()
+        record = await self.prefetch.wait(self.engine, arrival)
+        if record is not None:
+            self.quests.arrived_at_airport(record["municipality"])
+        else:
+            self.quests.arrived_at_airport()
 
     def update_airport(self, icao):
-        # Check customers at airport, generate them if necessary
-        airport_type = self.db.airport_type_icao(icao)
+        populate_airport(self.db, icao, self.assets.airports())
 
-        customers = self.db.customers_from_airport(self.airport)
+    # What the customer menu shows, built once per airport and kept until
+    # customers change
+    def customer_offers(self):
+        return self.offers.get()
 
-        if (len(customers) > 0):
-            return
+    # Which customers the offers should show, for the audit. Mustn't touch
+    # the RNG, or audited sessions wouldn't replay.
+    def offers_fingerprint(self):
+        return (self.airport, self.db.customer_states(self.airport))
+
+    async def animate_travel(self, waypoints):
+        from geopy.distance import geodesic
 
-        # Make sure airport has at least N customers
-        customers_tier1 = 1 # Small airports always have one customer
-        customers_tier2 = 0
-        match airport_type:
-            case "medium_airport":
-                customers_tier1 = 3
-                customers_tier2 = 0
-            case "large_airport":
-                customers_tier1 = 2
-                customers_tier2 = 3
-
-        if (aircraft.get_aircraft_type(self.db.con, aircraft.selected_aircraft) == "Small"):
-            customers_tier2 = 0 # Small aircraft can't take large airport customers
-
-        for i in range(0, customers_tier1):
-            customer = Customer(self.db)
-            customer.generate_tier1(icao)
-            customer.save()
-
-        for i in range(0, customers_tier2):
-            customer = Customer(self.db)
-            customer.generate_tier2(icao)
-            customer.save()
-
-    def animate_travel(self, waypoints):
         gfx = self.gfx
         cam = self.cam
-        anim_t0 = time.time()
+        quality = self.quality
+        frame = 0
+        # Engine clock, so replays animate frame for frame the same
+        anim_t0 = self.engine.clock()
         for i in range(1, len(waypoints)):
 
             a = waypoints[i-1]
@@ -132,55 +202,57 @@ class GameState:
 
             anim_dur = distance / 500.0 # km per second real-time
             while anim_t1 - anim_t0 < anim_dur:
-                anim_t1 = time.time()
+                await self.engine.tick()
+                anim_t1 = self.engine.clock()
                 t = (anim_t1 - anim_t0) / anim_dur
                 cam.gps = [
                     a[0] + t * (b[0] - a[0]),
                     a[1] + t * (b[1] - a[1])
                 ]
 
-                wp = compute_geodesic(cam.gps, waypoints[-1])
+                frame += 1
+                if frame % quality.get("frame_skip") != 0:
+                    continue
 
+                quality.begin_frame()
                 gfx.draw_map(cam)
-                gfx.draw_waypoints(cam, wp)
+                gfx.draw_geodesic(cam, cam.gps, waypoints[-1], tolerance=quality.get("tolerance"))
                 gfx.fb.scanout()
                 gfx.win.refresh()
+                quality.end_frame()
             anim_t0 = anim_t1
 
+    def close(self):
+        self.gfx.close()
+        self.prefetch.close()
+        self.engine.close()
+
 
 
 
+# The map passes run on every keystroke, they only read game.customer_offers()
 def customers_postpass(game):
-    customers = game.db.customers_from_airport(game.airport)
-    i = 0
-    for customer in customers:
-        i+=1
-        gps = game.db.airport_xy_icao(customer.destination)
-        put_gps_text(game.gfx.fb, game.cam, gps, f"● #{i}")
+    for offer in game.customer_offers().offers:
+        put_gps_text(game.gfx.fb, game.cam, offer.xy, f"● #{offer.number}")
 
 def customers_prepass(game):
-    customers = game.db.customers_from_airport(game.airport)
-    for customer in customers:
-        gps = game.db.airport_xy_icao(customer.destination)
-        wp = compute_geodesic(game.cam.gps, gps)
-        game.gfx.draw_waypoints(game.cam, wp)
+    for points in game.customer_offers().route_polylines(game.cam, game.gfx.fb):
+        game.gfx.draw_waypoints(game.cam, points)
 
 
-def menu_find_customers(game):
-    game.update_airport(game.airport)
-    customers = game.db.customers_from_airport(game.airport)
+async def menu_find_customers(game):
+    # Customer generation takes a while, let the loop breathe meanwhile
+    await game.engine.run_blocking(game.update_airport, game.airport)
+    offers = game.customer_offers()
     popup = Popup(game)
 
-    i = 0
-    for customer in customers:
-        i+=1
-        if (customer.accepted):
-            continue
+    for offer in offers.waiting():
+        customer = offer.customer
+        i = offer.number
         popup.add_text(f"#{i}: {customer.name}")
-        distance = game.db.icao_distance(customer.origin, customer.destination)
-        popup.add_text(f"{customer.origin} -> {customer.destination} ({game.db.airport_type_icao(customer.destination)})")
+        popup.add_text(f"{customer.origin} -> {customer.destination} ({offer.type})")
 
-        popup.add_text(f"Distance: {int(distance)} km")
+        popup.add_text(f"Distance: {int(offer.distance)} km")
         popup.add_text(f"Reward:   $ {customer.reward}")
         popup.add_text(f"")
         popup.add_option(f"Board customer #{i}", i)
@@ -190,17 +262,17 @@ def menu_find_customers(game):
 
     popup.postpass = customers_postpass
     popup.prepass = customers_prepass
-    action = popup.run()
+    action = await popup.run()
 
     if action == "Return":
         return
 
-    customers[action-1].accept()
+    offers.offers[action-1].customer.accept()
 
 
 
 
-def menu_fly(game):
+async def menu_fly(game):
     customers = game.db.accepted_customers()
     popup = Popup(game)
     i = 0
@@ -214,27 +286,66 @@ def menu_fly(game):
         popup.add_option(f"Fly to {customer.destination}", customer.destination)
 
     popup.add_option(f"Choose on map")
+    popup.add_option(f"Plan route with fuel stops")
     popup.add_option(f"Return")
-    target = popup.run()
+    target = await popup.run()
+
+    if (target == "Plan route with fuel stops"):
+        await menu_route(game)
+        return
 
     if (target == "Choose on map"):
-        target = choose_airport_from_map(game)
+        target = await choose_airport_from_map(game)
+
+    await game.fly_to( target )
 
-    game.fly_to( target )
 
+async def menu_route(game):
+    target = await choose_airport_from_map(game, reachable_only=False)
+    if target == "" or target == game.airport:
+        return
+
+    mode = await impopup(game, [f"Route to {target}"], ["Fewest stops", "Shortest distance", "Return"])
+    if mode == "Return":
+        return
 
-def menu_hangar(game):
+    airports = await game.engine.wait(game.assets.airports_job)
+    range_km = game.aircraft_range.get()
+    route = await game.engine.run_blocking(
+        plan_route, airports, stop_index(airports), game.airport, target, range_km,
+        "stops" if mode == "Fewest stops" else "distance")
+
+    if route is None:
+        await impopup(game, [f"No route to {target} with a range of {range_km} km"], ["Ok"])
+        return
+
+    popup = Popup(game)
+    popup.add_text(f"{len(route)-1} legs, {int(route_distance_km(airports, route))} km")
+    popup.add_text(f"")
+    for k in range(1, len(route)):
+        leg = int(route_distance_km(airports, route[k-1:k+1]))
+        popup.add_text(f"{route[k-1]} -> {route[k]} ({leg} km)")
+    popup.add_option("Fly route")
+    popup.add_option("Return")
+    action = await popup.run()
+
+    if action == "Fly route":
+        for leg in route[1:]:
+            await game.fly_to(leg)
+
+
+async def menu_hangar(game):
     all_aircraft = game.db.get_all_aircraft()
     popup = Popup(game)
     popup.add_text("Hangar")
-    popup.add_text(f"Selected aircraft: {aircraft.selected_aircraft}")
+    popup.add_text(f"Selected aircraft: {game.db.selected_aircraft}")
     i = 0
     for ac in all_aircraft:
         i+=1
         #Get aircraft name
         popup.add_option(f"#{i}: {ac[1]}" + (" [Owned]" if ac[10] else ""), ac[0])
     popup.add_option("Return")
-    target = popup.run()
+    target = await popup.run()
 
     if target == "Return":
         return
@@ -244,23 +355,25 @@ def menu_hangar(game):
         popup.add_text(f"Purchase {all_aircraft[target-1][1]} for ${all_aircraft[target-1][9]} million?")
         popup.add_option("Yes")
         popup.add_option("No")
-        action = popup.run()
+        action = await popup.run()
         if action == "Yes":
 
-            if game.money < all_aircraft[target-1][9] * 1_000_000:
-                impopup(game, ["Not enough money"], ["OK"])
+            cost = aircraft.purchase_cost(all_aircraft[target-1][9])
+            if game.money < cost:
+                await impopup(game, ["Not enough money"], ["OK"])
             else:
                 aircraft.purchase_aircraft(game.db.con, all_aircraft[target-1][1])
-                impopup(game, [f"{all_aircraft[target-1][1]} purchased"], ["OK"])
+                game.set_money(game.money - cost)
+                await impopup(game, [f"{all_aircraft[target-1][1]} purchased"], ["OK"])
     else:
         popup = Popup(game)
         popup.add_text("Select aircraft?")
         popup.add_option("Yes")
         popup.add_option("No")
-        action = popup.run()
+        action = await popup.run()
         if action == "Yes":
-            aircraft.selected_aircraft = all_aircraft[target-1][1]
-            impopup(game, [f"{all_aircraft[target-1][1]} selected"], ["OK"])
+            game.db.select_aircraft(all_aircraft[target-1][1])
+            await impopup(game, [f"{all_aircraft[target-1][1]} selected"], ["OK"])
             #Kill all customers
             game.db.kill_all_customers()
 
@@ -269,172 +382,277 @@ def menu_hangar(game):
 
 
 
-def draw_large_airports(fb, cam, con):
-    try:
-        cur = con.cursor()
-        query = 'SELECT longitude_deg, latitude_deg, ident FROM airport WHERE type="large_airport"'
-        cur.execute(query)
-        for (lon, lat, ident) in cur:
-            put_gps_text(fb, cam, (lon, lat), f"● {ident}")
-    except Exception as e:
-        print(f"Error fetching large airports: {e}")
-
-def draw_medium_airports(fb, cam, con):
-    try:
-        cur = con.cursor()
-        query = 'SELECT longitude_deg, latitude_deg, ident FROM airport WHERE type="medium_airport"'
-        cur.execute(query)
-        for (lon, lat, ident) in cur:
-            put_gps_text(fb, cam, (lon, lat), f"● {ident}")
-    except Exception as e:
-        print(f"Error fetching medium airports: {e}")
+# Read every key waiting (see Engine.getkeys()) and apply the pan and zoom
+# keys among them to the camera, so the next frame shows where they all
+# lead. Returns the first other key, or -1; the keys after it are handed
+# back for later.
+async def camera_keys(game, pan_speed):
+    cam = game.cam
+    keys = await game.engine.getkeys()
+    for (i, ch) in enumerate(keys):
+        if ch == ord("a") or ch == curses.KEY_LEFT:
+            cam.gps[0] -= cam.zoom * pan_speed
+
+        elif ch == ord("d") or ch == curses.KEY_RIGHT:
+            cam.gps[0] += cam.zoom * pan_speed
+
+        elif ch == ord("w") or ch == curses.KEY_UP:
+            cam.gps[1] += cam.zoom * pan_speed
+
+        elif ch == ord("s") or ch == curses.KEY_DOWN:
+            cam.gps[1] -= cam.zoom * pan_speed
+
+        elif ch == ord("z"):
+            cam.zoom *= 2.0
+
+        elif ch == ord("x"):
+            cam.zoom *= 0.5
+
+        else:
+            game.engine.unget(keys[i+1:])
+            return ch
+    return -1
+
 
+def draw_large_airports(fb, cam, airports):
+    for i in airports.of_type("large_airport"):
+        put_gps_text(fb, cam, (airports.lon[i], airports.lat[i]), f"● {airports.ident[i]}")
 
-def freecam(game):
+def draw_medium_airports(fb, cam, airports):
+    for i in airports.of_type("medium_airport"):
+        put_gps_text(fb, cam, (airports.lon[i], airports.lat[i]), f"● {airports.ident[i]}")
+
+
+async def freecam(game):
 
     gfx = game.gfx
     cam = game.cam
+    airports = await game.engine.wait(game.assets.airports_job)
+
+    quality = game.quality
 
     pos = game.db.airport_xy_icao("EFHK")
     while True:
-        t_start = time.time()
+        quality.begin_frame()
+        t_start = game.engine.clock()
 
         gfx.draw_map(cam)
 
+        gfx.draw_geodesic(cam, pos, cam.gps, tolerance=quality.get("tolerance"))
+        # Flight path for Enter/l
         waypoints = compute_geodesic(pos, cam.gps)
-        gfx.draw_waypoints(cam, waypoints)
 
         gfx.fb.scanout()
 
-        t_end = time.time()
+        t_end = game.engine.clock()
 
-        if (cam.zoom <= 15.0):
-            draw_large_airports(gfx.fb, cam, game.db.con)
-        if (cam.zoom <= 7.5):
-            draw_medium_airports(gfx.fb, cam, game.db.con)
+        if (cam.zoom <= 15.0 and quality.get("labels") >= 1):
+            draw_large_airports(gfx.fb, cam, airports)
+        if (cam.zoom <= 7.5 and quality.get("labels") >= 2):
+            draw_medium_airports(gfx.fb, cam, airports)
 
-        gfx.win.addstr(0,0,f"Rendered in {(t_end-t_start)*1000 : 0.2f} ms, zoom {cam.zoom}, lon {cam.gps[0]:.2f} lat {cam.gps[1]:.2f}")
-        gfx.win.addstr(1,0,f"Controls: wasd to move, zx to zoom, p to toggle reprojection, Enter/l to animate travel, e to set origin")
+        gfx.fb.addstr(0,0,f"Rendered in {(t_end-t_start)*1000 : 0.2f} ms, zoom {cam.zoom}, lon {cam.gps[0]:.2f} lat {cam.gps[1]:.2f}")
+        gfx.fb.addstr(1,0,f"Controls: wasd to move, zx to zoom, p to toggle reprojection, b for braille, Enter/l to animate travel, e to set origin")
         gfx.win.refresh()
+        quality.end_frame()
 
         # Input handling
         # Python is stupid
         pan_speed = 0.1
-        ch = gfx.win.getch()
+        ch = await camera_keys(game, pan_speed)
         if ch == ord("q"):
             break
 
-        elif ch == ord("a") or ch == curses.KEY_LEFT:
-            cam.gps[0] -= cam.zoom * pan_speed
-
-        elif ch == ord("d") or ch == curses.KEY_RIGHT:
-            cam.gps[0] += cam.zoom * pan_speed
-
-        elif ch == ord("w") or ch == curses.KEY_UP:
-            cam.gps[1] += cam.zoom * pan_speed
-
-        elif ch == ord("s") or ch == curses.KEY_DOWN:
-            cam.gps[1] -= cam.zoom * pan_speed
-
         elif ch == curses.KEY_ENTER or ch == 10 or ch == 13:
-            game.animate_travel(waypoints)
+            await game.animate_travel(waypoints)
             pos = cam.gps.copy()
 
         elif ch == ord("l"):
-            game.animate_travel(waypoints)
+            await game.animate_travel(waypoints)
 
         elif ch == ord("e"):
             pos[0] = cam.gps[0]
             pos[1] = cam.gps[1]
 
-        elif ch == ord("z"):
-            cam.zoom *= 2.0
+        elif ch == ord("p"):
+            cam.toggle_projection()
 
-        elif ch == ord("x"):
-            cam.zoom *= 0.5
+        elif ch == ord("b"):
+            gfx.fb.set_braille(gfx.fb.sub_rows == 2)
 
 
-def choose_airport_from_map(game):
+# With reachable_only the picker only offers airports within range of the
+# selected aircraft, otherwise the range is only shown.
+async def choose_airport_from_map(game, reachable_only=True):
 
     gfx = game.gfx
     cam = game.cam
+    airports = await game.engine.wait(game.assets.airports_job)
+
+    # Airports within range, computed once per airport and aircraft
+    if game.reach is None:
+        from airports import ReachCache
+        game.reach = ReachCache(airports)
+    range_km = game.aircraft_range.get()
+    reach = game.reach.get(game.airport, game.db.selected_aircraft, range_km)
+
+    quality = game.quality
 
     pos = game.db.airport_xy_icao(game.airport)
     while True:
-        t_start = time.time()
+        quality.begin_frame()
+        t_start = game.engine.clock()
 
         gfx.draw_map(cam)
+        gfx.draw_path(cam, reach.circle, 2)
 
         closest_icao = game.airport
         closest_distance = float('inf')
-        if True:
-            cur = game.db.con.cursor()
-            query = 'SELECT longitude_deg, latitude_deg, ident FROM airport WHERE type="large_airport"'
-            if (cam.zoom <= 7.5):
-                query = 'SELECT longitude_deg, latitude_deg, ident FROM airport WHERE type IN ("medium_airport", "large_airport")'
-            cur.execute(query)
-            for (lon, lat, ident) in cur:
-                put_gps_text(game.gfx.fb, cam, (lon,lat), f"● {ident}")
-                # Square root not necessary, we don't need the true distance,
-                # only relative.
-                distance = (lon - cam.gps[0])**2 + (lat - cam.gps[1])**2
-                if (closest_distance > distance):
-                    closest_distance = distance
-                    closest_icao = ident
-
-
-        waypoints = compute_geodesic(pos, game.db.airport_xy_icao(closest_icao))
-        gfx.draw_waypoints(cam, waypoints)
+        rows = airports.of_type("large_airport")
+        if (cam.zoom <= 7.5):
+            rows = airports.of_type("medium_airport", "large_airport")
+        for i in rows:
+            if reachable_only and i not in reach:
+                continue
+            lon   = airports.lon[i]
+            lat   = airports.lat[i]
+            # Square root not necessary, we don't need the true distance,
+            # only relative.
+            # Longitude difference the short way round
+            dlon = (lon - cam.gps[0] + 180.0) % 360.0 - 180.0
+            distance = dlon**2 + (lat - cam.gps[1])**2
+            if (closest_distance > distance):
+                closest_distance = distance
+                closest_icao = airports.ident[i]
+
+
+        gfx.draw_geodesic(cam, pos, airports.xy(closest_icao), tolerance=quality.get("tolerance"))
 
         gfx.fb.scanout()
 
-        t_end = time.time()
+        t_end = game.engine.clock()
 
-        if (cam.zoom <= 15.0):
-            draw_large_airports(gfx.fb, cam, game.db.con)
+        if (cam.zoom <= 15.0 and quality.get("labels") >= 1):
+            draw_large_airports(gfx.fb, cam, airports)
 
-        if (cam.zoom <= 7.5):
-            draw_medium_airports(gfx.fb, cam, game.db.con)
+        if (cam.zoom <= 7.5 and quality.get("labels") >= 2):
+            draw_medium_airports(gfx.fb, cam, airports)
 
-        gfx.win.addstr( gfx.fb.h//2, gfx.fb.w//2, "X" )
+        # Reachable airports on top, highlighted. Always drawn, they're what
+        # the player is choosing from.
+        for i in rows:
+            if i in reach:
+                put_gps_text(gfx.fb, cam, (airports.lon[i], airports.lat[i]), f"● {airports.ident[i]}", gfx.fb.color_pair(3))
 
-        gfx.win.addstr(0,0,f"Rendered in {(t_end-t_start)*1000 : 0.2f} ms, zoom {cam.zoom}, lon {cam.gps[0]:.2f} lat {cam.gps[1]:.2f}")
-        gfx.win.addstr(2,0,f"Closest: {closest_icao}")
+        gfx.fb.addstr( gfx.fb.h//2, gfx.fb.w//2, "X" )
+
+        gfx.fb.addstr(0,0,f"Rendered in {(t_end-t_start)*1000 : 0.2f} ms, zoom {cam.zoom}, lon {cam.gps[0]:.2f} lat {cam.gps[1]:.2f}")
+        gfx.fb.addstr(2,0,f"Closest: {closest_icao}")
         gfx.win.refresh()
+        quality.end_frame()
 
         # Input handling
         # Python is stupid
         pan_speed = 0.075
-        ch = gfx.win.getch()
+        ch = await camera_keys(game, pan_speed)
         if ch == ord("q"):
             return ""
 
-        elif ch == ord("a") or ch == curses.KEY_LEFT:
-            cam.gps[0] -= cam.zoom * pan_speed
-
-        elif ch == ord("d") or ch == curses.KEY_RIGHT:
-            cam.gps[0] += cam.zoom * pan_speed
-
-        elif ch == ord("w") or ch == curses.KEY_UP:
-            cam.gps[1] += cam.zoom * pan_speed
-
-        elif ch == ord("s") or ch == curses.KEY_DOWN:
-            cam.gps[1] -= cam.zoom * pan_speed
-
         elif ch == curses.KEY_ENTER or ch == 10 or ch == 13:
             return closest_icao
 
-        elif ch == ord("z"):
-            cam.zoom *= 2.0
-
-        elif ch == ord("x"):
-            cam.zoom *= 0.5
-
 
 
-def main():
-    game = GameState()
+# Bytes held by the larger game data, for the developer menu. Measured on
+# what's loaded right now, so open the customer menu first to see customers
+# and routes.
+def memory_report(game):
+    lines = []
+    if game.assets.map_ready():
+        geom = game.assets.map()
+        levels = sum(g.nbytes() for g in geom.lods.values())
+        lines.append(f"Map: {len(geom.x)} vertices, {geom.nbytes()//1024} KiB, {levels//1024} KiB with detail levels")
+    tiles = game.gfx.tiles
+    lines.append(f"Map tiles: {len(tiles.tiles)} tiles, {tiles.bytes//1024} KiB")
 
+    # Customers at this airport and on board: the objects and what they hold
+    # (the db is shared)
+    customers = game.db.accepted_customers()
+    offers = game.offers.value
+    if offers is not None:
+        customers += [offer.customer for offer in offers.offers]
+    fields = [name for name in Customer.__slots__ if name != "db"]
+    size = sum(sys.getsizeof(c) + sum(sys.getsizeof(getattr(c, name)) for name in fields)
+        for c in customers)
+    lines.append(f"Customers: {len(customers)} loaded, {size} bytes")
+    if game.db.store is not None:
+        store = game.db.store
+        lines.append(f"Customer store: {len(store)} customers, {store.data.nbytes//1024} KiB")
+
+    if offers is not None and offers.routes is not None:
+        points = sum(len(route) for route in offers.routes)
+        size = sum(route.nbytes() for route in offers.routes)
+        lines.append(f"Offer routes: {len(offers.routes)} paths, {points} points, {size} bytes")
+    return lines
+
+
+# Fill every airport with customers and keep them all in memory, see
+# demand.py. Returns lines for the developer menu.
+async def world_demand(game):
+    airports = await game.engine.wait(game.assets.airports_job)
+    t_start = time.perf_counter()
+    added = await game.engine.run_blocking(game.db.load_demand, airports)
+    t_loaded = time.perf_counter()
+
+    store = game.db.store
+    waiting = store.select(accepted=0)
+    t_query = time.perf_counter()
+    here = store.select(origin=game.airport, accepted=0)
+    t_end = time.perf_counter()
+    counts = store.totals_by_origin(waiting)[0]
+    stats = aircraft.get_stats(game.db.con, game.db.selected_aircraft)
+    (checked, off) = await game.engine.run_blocking(demand.count_mismatches, store, stats)
+
+    lines = [
+        f"{len(waiting)} open offers at {int((counts > 0).sum())} airports, {added} new",
+        f"Generated and saved in {(t_loaded-t_start)*1000:.0f} ms",
+        f"{len(here)} at {game.airport}, found in {(t_end-t_query)*1000:.2f} ms",
+        f"{len(off)} of {checked} airports off customer_counts()",
+        f"",
+        f"Best paying:",
+    ]
+    for i in store.top_by_reward(waiting, 5):
+        row = store.data[i]
+        lines.append(f"{store.codes[row['origin']]} -> {store.codes[row['destination']]}  $ {row['reward']}")
+    return lines
+
+
+# Airports that get customers before the first menu with --world
+SEED_TYPES = ("medium_airport", "large_airport")
+
+# Generate customers for every medium and large airport at once, see
+# demand.seed_world(), instead of one airport at a time on arrival
+async def seed_world(game):
+    game.win.addstr(0, 0, "Generating customers for the world...")
+    game.win.refresh()
+    loader.first_frame()
+
+    airports = await game.engine.wait(game.assets.airports_job)
+    store = await game.engine.run_blocking(game.db.open_store, airports)
+    origins = demand.empty_airports(store, SEED_TYPES)
+    stats = aircraft.get_stats(game.db.con, game.db.selected_aircraft)
+    seed = randomness.source.getrandbits(64)
+
+    rows = await game.engine.run_blocking(demand.seed_world, airports, origins, stats, seed)
+    await game.engine.run_blocking(game.db.use_store, store, rows)
+    loader.mark("world")
+
+
+# The main menu, returns when the player quits. world seeds the whole world
+# with customers first, see seed_world()
+async def play(game, world=False):
+    if world:
+        await seed_world(game)
     while True:
         game.cam.gps = game.db.airport_xy_icao(game.airport)
 
@@ -442,19 +660,19 @@ def main():
         for customer in customers_on_board:
             if game.airport != customer.destination:
                 continue
-            do_default = game.quests.completed_customer_flight(customer)
+            do_default = await game.quests.completed_customer_flight(customer)
             if do_default:
-                impopup(game,
+                await impopup(game,
                     [f"You have completed {customer.name}'s flight, and were rewarded ${customer.reward}"],
                     ["Ok"]
                 )
-                game.money += customer.reward
+                game.set_money(game.money + customer.reward)
                 customer.drop()
 
         popup = Popup(game)
         popup.add_text(f"At airport {game.airport}" )
         popup.add_text(f"Money: ${game.money}" )
-        popup.add_text(f"Selected aircraft: {aircraft.selected_aircraft}" )
+        popup.add_text(f"Selected aircraft: {game.db.selected_aircraft}" )
         popup.add_text(f"")
         popup.add_option("Look for customers")
         popup.add_option("Fly to destination")
@@ -463,56 +681,130 @@ def main():
         popup.add_option("")
         popup.add_option("Developer options")
         popup.add_option("Quit game")
-        action = popup.run()
+        action = await popup.run()
 
         if action == "Developer options":
-            action = impopup(game, [], [
+            action = await impopup(game, [], [
                 "Freecam",
                 "Reset",
                 "Fly to KJFK",
                 "Quest flags",
                 "Force money",
+                "Startup timings",
+                "Index check",
+                "Render quality",
+                "Parallel renderer",
+                "Event audit",
+                "Memory footprint",
+                "World demand",
                 "Return"])
             if action == "Reset":
                 game.db.reset()
-                impopup(game, ["Database reset"], ["Ok"])
+                await impopup(game, ["Database reset"], ["Ok"])
             elif action == "Freecam":
-                freecam(game)
+                await freecam(game)
             elif action == "Fly to KJFK":
-                game.fly_to("KJFK")
+                await game.fly_to("KJFK")
             elif action == "Quest flags":
-                impopup(game, game.quests.all_flags(), ["Return"])
+                await impopup(game, game.quests.all_flags(), ["Return"])
 
             elif action == "Force money":
-                game.money = 10_000_000
-                impopup(game, ["Money set to 10 million"], ["Ok"])
+                game.set_money(10_000_000)
+                await impopup(game, ["Money set to 10 million"], ["Ok"])
+
+            elif action == "Startup timings":
+                await impopup(game, loader.report(), ["Return"])
+
+            elif action == "Index check":
+                await impopup(game, game.db.check_indexes(), ["Return"])
+
+            elif action == "Render quality":
+                await impopup(game, [game.quality.describe()], ["Return"])
+
+            elif action == "Event audit":
+                await impopup(game, game.events.report(), ["Return"])
+
+            elif action == "Memory footprint":
+                await impopup(game, memory_report(game), ["Return"])
+
+            elif action == "World demand":
+                await impopup(game, await world_demand(game), ["Return"])
+
+            elif action == "Parallel renderer":
+                game.gfx.set_parallel(game.gfx.bands is None)
+                if game.gfx.bands is not None:
+                    await impopup(game, [f"Parallel renderer on, {game.gfx.bands.workers} workers"], ["Ok"])
+                else:
+                    await impopup(game, ["Parallel renderer off"], ["Ok"])
                 
 
         elif action == "Look for customers":
-            menu_find_customers(game)
+            await menu_find_customers(game)
 
         elif action == "View your customers":
             pass
 
         elif action == "Hangar":
-            menu_hangar(game)
+            await menu_hangar(game)
             
             
 
 
 
         elif action == "Fly to destination":
-            menu_fly(game)
+            await menu_fly(game)
 
         elif action == "Quit game":
-            impopup(game, [], ["Bye bye !"])
+            await impopup(game, [], ["Bye bye !"])
             break
 
-    game.win.keypad(False)
-    curses.nocbreak()
-    curses.echo()
-    curses.endwin()
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", type=int, help="seed for customers and rewards")
+    parser.add_argument("--record", metavar="FILE", help="record input for replay.py")
+    parser.add_argument("--ansi", action="store_true", help="draw with ANSI escapes instead of curses")
+    parser.add_argument("--audit", action="store_true", help="report reads of caches that missed a state change")
+    parser.add_argument("--world", action="store_true", help="generate customers for every medium and large airport at start")
+    parser.add_argument("--braille", action="store_true", help="draw the map with braille dots, twice the vertical detail")
+    args = parser.parse_args()
+
+    seed = args.seed
+    if seed is None and args.record:
+        seed = randomness.new_seed()
+    if seed is not None:
+        randomness.seed(seed)
+
+    win = None
+    if args.ansi:
+        from terminal import TerminalWindow
+        win = TerminalWindow(COLOR_PAIRS)
+        loader.mark("terminal")
+
+    game = GameState(win, audit=args.audit)
+    if args.braille:
+        game.gfx.fb.set_braille(True)
+    if args.record:
+        game.engine.record(args.record, seed, args.world, args.braille)
+
+    try:
+        await play(game, world=args.world)
+    finally:
+        game.close()
+
+    if args.ansi:
+        game.win.close()
+    else:
+        game.win.keypad(False)
+        curses.nocbreak()
+        curses.echo()
+        curses.endwin()
+
+    if loader.over_budget():
+        print(f"Startup took {loader.first_frame_ms:.0f} ms, budget is {loader.STARTUP_BUDGET_MS} ms", file=sys.stderr)
+        for line in loader.report():
+            print(line, file=sys.stderr)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
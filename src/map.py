@@ -1,17 +1,12 @@
 #!/usr/bin/env python3
-import database
-import textwrap
-import shapefile
 import array
 import math
-import time
 import curses
-from geopy.distance import great_circle
-from geopy.distance import geodesic
 
-from customer import Customer
-from popup import Popup
+import numpy as np
+
 from vec3 import *
+from tiles import TileCache
 
 # Map.py
 
@@ -109,6 +104,16 @@ from vec3 import *
 # Character palette used for rendering
 #lut = (" ","▘","▝","▀","▖","▌","▞","▛","▗","▚","▐","▜","▄","▙","▟","█");
 lut = (" ","`","'","\"",",",":","/","F",".","\\",":","\\","_","b","d","-");
+# The same as a NumPy array, for looking up whole frames, see scanout()
+GLYPHS = np.array(lut)
+
+# Braille mode: 2x4 subpixels per cell, one dot each. Subpixel bit x + 2*y is
+# braille dot BRAILLE_DOTS[x + 2*y]: dots are numbered down the left column,
+# then the right one, with the bottom row last.
+BRAILLE_DOTS = (0, 3, 1, 4, 2, 5, 6, 7)
+BRAILLE_GLYPHS = np.array([" "] + [
+    chr(0x2800 + sum(1 << BRAILLE_DOTS[bit] for bit in range(8) if mask >> bit & 1))
+    for mask in range(1, 256)])
 
 
 
@@ -146,65 +151,301 @@ def gps_to_mercator(gps):
 
 # "In geometry, a geodesic is a curve representing the locally
 # shortest path (arc) between two points in a surface" - Wikipedia
-# This is ultimately just a bad sphere lerp
-def compute_geodesic(gps_a, gps_b):
-    waypoints = []
 
+# Spherical interpolation between unit vectors a and b, angle is the angle
+# between them
+def slerp(a, b, angle, t):
+    s = math.sin(angle)
+    if s < 1e-9:
+        return a.copy()
+    wa = math.sin((1.0-t) * angle) / s
+    wb = math.sin(t * angle) / s
+    return [wa*a[0] + wb*b[0], wa*a[1] + wb*b[1], wa*a[2] + wb*b[2]]
+
+def usphere_angle(a, b):
+    dot = a[0]*b[0] + a[1]*b[1] + a[2]*b[2]
+    return math.acos(max(-1.0, min(1.0, dot)))
+
+# GPS of a unit vector, with the longitude moved by whole turns to within
+# 180 degrees of ref_lon
+def usphere_to_gps_near(vec, ref_lon):
+    gps = usphere_to_gps(vec)
+    gps[0] += 360.0 * round((ref_lon - gps[0]) / 360.0)
+    return gps
+
+# Evenly spaced points along the great circle, steps+1 of them. Longitudes
+# are continuous (they can go past +-180), so a camera moving along them
+# doesn't jump across the map. Used as the path of flight animations; for
+# drawing use geodesic_polylines().
+def compute_geodesic(gps_a, gps_b, steps=15):
     a = gps_to_usphere(gps_a)
     b = gps_to_usphere(gps_b)
+    angle = usphere_angle(a, b)
 
-    # Resolution of geodesic
-    steps = 15
-
-    for step in range(0, steps+1):
-        t = (step/steps);
-
-        # Interpolate between two vectors
-        c = [
-            a[0] + t * (b[0] - a[0]),
-            a[1] + t * (b[1] - a[1]),
-            a[2] + t * (b[2] - a[2]),
-        ]
+    waypoints = Waypoints([gps_a])
+    for step in range(1, steps+1):
+        c = slerp(a, b, angle, step/steps)
+        waypoints.append(usphere_to_gps_near(c, waypoints.lon[-1]))
+    return waypoints
 
-        vec3_normalize(c)
-        gps = usphere_to_gps(c)
 
-        waypoints.append(gps)
-    return waypoints
+# A path kept as two arrays, longitudes and latitudes, instead of a list of
+# [lon, lat] lists: 16 bytes a point instead of about 130. Indexing gives
+# (lon, lat) tuples, so it reads like a list of points.
+class Waypoints:
+    __slots__ = ("lon", "lat")
+
+    def __init__(self, points=()):
+        self.lon = array.array('d')
+        self.lat = array.array('d')
+        for gps in points:
+            self.append(gps)
+
+    def append(self, gps):
+        self.lon.append(gps[0])
+        self.lat.append(gps[1])
+
+    def __len__(self):
+        return len(self.lon)
+
+    def __getitem__(self, i):
+        return (self.lon[i], self.lat[i])
+
+    def nbytes(self):
+        return self.lon.itemsize * (len(self.lon) + len(self.lat))
+
+
+# Cut a path with continuous longitudes into pieces that stay within
+# -180..180, so a line crossing the antimeridian doesn't get drawn across the
+# whole map
+def split_antimeridian(points):
+    def turn(lon):
+        return math.floor((lon + 180.0) / 360.0)
+
+    k = turn(points[0][0])
+    piece = [[points[0][0] - 360.0*k, points[0][1]]]
+    pieces = [piece]
+    for i in range(1, len(points)):
+        (lon0, lat0) = points[i-1][0], points[i-1][1]
+        (lon1, lat1) = points[i][0], points[i][1]
+        k1 = turn(lon1)
+        if k1 != k:
+            boundary = 360.0*max(k, k1) - 180.0
+            t = (boundary - lon0) / (lon1 - lon0)
+            lat = lat0 + t * (lat1 - lat0)
+            piece.append([boundary - 360.0*k, lat])
+            piece = [[boundary - 360.0*k1, lat]]
+            pieces.append(piece)
+            k = k1
+        piece.append([lon1 - 360.0*k, lat1])
+    return pieces
+
+
+# Arcs longer than this are always split, shorter ones are only split if they
+# don't look straight enough on screen
+GEODESIC_MAX_ANGLE = math.radians(10)
+GEODESIC_MAX_DEPTH = 16
+
+# The great circle from gps_a to gps_b as it should be drawn with the given
+# camera (after update_clip()): a list of polylines, split at the
+# antimeridian. Arcs are halved until each piece is within tolerance cells of
+# a straight line on screen, so short hops get a couple of points and long
+# routes as many as they need. Pieces off screen aren't refined.
+def geodesic_polylines(cam, fb, gps_a, gps_b, tolerance=0.5):
+    a = gps_to_usphere(gps_a)
+    b = gps_to_usphere(gps_b)
+    angle = usphere_angle(a, b)
+
+    # Cells per 360 degrees of longitude, to test the map's copies left and
+    # right of the camera too
+    shifts = (0.0,)
+    if cam.projection.flat:
+        turn = 360.0 * fb.w / cam.scale[0]
+        shifts = (-turn, 0.0, turn)
+
+    def project(gps):
+        clip = cam.project_gps(gps)
+        if clip is None:
+            return None
+        return (clip[0] * fb.w, clip[1] * fb.h)
+
+    # Out of sight arcs aren't refined, except where they cross the edge of
+    # the globe
+    def offscreen(p0, p1, p2):
+        if p0 is None or p1 is None or p2 is None:
+            return p0 is None and p1 is None and p2 is None
+        y0 = min(p0[1], p1[1], p2[1])
+        y1 = max(p0[1], p1[1], p2[1])
+        if y1 < -1 or y0 > fb.h + 1:
+            return True
+        x0 = min(p0[0], p1[0], p2[0])
+        x1 = max(p0[0], p1[0], p2[0])
+        for shift in shifts:
+            if x1 + shift >= -1 and x0 + shift <= fb.w + 1:
+                return False
+        return True
+
+    points = []
+    limit = tolerance * tolerance
+
+    def subdivide(ua, ga, pa, ub, gb, pb, depth):
+        if depth >= GEODESIC_MAX_DEPTH:
+            return
+        um = [ua[0]+ub[0], ua[1]+ub[1], ua[2]+ub[2]]
+        vec3_normalize(um)
+        gm = usphere_to_gps_near(um, ga[0])
+        pm = project(gm)
+        if offscreen(pa, pb, pm):
+            return
+        if pa is not None and pb is not None and pm is not None:
+            ex = (pa[0] + pb[0]) * 0.5 - pm[0]
+            ey = (pa[1] + pb[1]) * 0.5 - pm[1]
+            if ex*ex + ey*ey <= limit:
+                return
+        subdivide(ua, ga, pa, um, gm, pm, depth+1)
+        points.append(gm)
+        subdivide(um, gm, pm, ub, gb, pb, depth+1)
+
+    # Even steps short enough that the midpoint tests can be trusted, then
+    # refine each one
+    steps = max(1, math.ceil(angle / GEODESIC_MAX_ANGLE))
+    ua = a
+    ga = list(gps_a)
+    pa = project(ga)
+    points.append(ga)
+    for step in range(1, steps+1):
+        ub = b if step == steps else slerp(a, b, angle, step/steps)
+        gb = usphere_to_gps_near(ub, ga[0])
+        pb = project(gb)
+        subdivide(ua, ga, pa, ub, gb, pb, 0)
+        points.append(gb)
+        (ua, ga, pa) = (ub, gb, pb)
+
+    return split_antimeridian(points)
 
 
 
 # Writing text to buffer must be done *after* map scanout
-def put_gps_text(fb, cam, gps, text):
+# Drawn on every copy of the world that's in view, see Camera.copies
+def put_gps_text(fb, cam, gps, text, attr=0):
     label = cam.project_gps(gps)
-    x = int(label[0] * fb.w)
+    if label is None:
+        return
     y = int(label[1] * fb.h)
-    if not (x < 0 or y < 0 or x >= fb.w or y >= fb.h):
-        fb.win.addstr( y, x, text )
+    if y < 0 or y >= fb.h:
+        return
+    for offset in cam.copies:
+        x = int((label[0] + offset) * fb.w)
+        if not (x < 0 or x >= fb.w):
+            fb.addstr( y, x, text, attr )
 
 
 
 # This is the buffer from which ascii graphics are ultimately generated
-# Each pixel gets a 32bit value; last 4 bits are "subpixels", other bits
+# Each pixel gets a 32bit value; the last 4 bits (8 in braille mode, see
+# set_braille()) are "subpixels", the bits from 8 up
 # determine color and such
+#
+# Three buffers of the same size are kept:
+# map    - the rasterized map only. Kept between frames, so when the camera
+#          pans by whole cells it can be shifted instead of redrawn.
+# buffer - the frame being drawn: a copy of map plus waypoints etc.
+# front  - what was last sent to the terminal. scanout() only touches cells
+#          that differ from it. Cells covered by text are set to -1.
 class FrameBuffer:
     def __init__(self, win):
         self.w = 300
         self.h = 80
-        self.buffer = []
+        self.size = None
         self.win = win
+        # Headless windows (see headless.py) bring their own, curses'
+        # needs initscr()
+        self.color_pair = getattr(win, "color_pair", curses.color_pair)
         self.update()
 
+        # Subpixel rows per cell and the glyph for each subpixel mask, see
+        # set_braille()
+        self.sub_rows = 2
+        self.glyphs = GLYPHS
+
+        # Camera view the map layer was rasterized for, see Camera.view()
+        self.map_view = None
+
     def update(self):
         maxyx = self.win.getmaxyx()
         self.h = maxyx[0]-1
         self.w = maxyx[1]-1
 
+    # The layers are h x w NumPy arrays of cells, so whole frames can be
+    # copied, compared and turned into text without a Python loop per cell.
+    # map_cells and buffer_cells are flat views of the same memory, for code
+    # that writes cells one at a time (write_subpixel()) or a row at a time
+    # (TileCache.blit()), where they're faster than indexing NumPy.
     def clear(self):
         self.update()
-        required_len = self.w * self.h
-        if (len(self.buffer) != required_len):
-            self.buffer =  array.array('i', ([0]*(required_len)))
+        if (self.size != (self.w, self.h)):
+            self.size = (self.w, self.h)
+            self.buffer = np.zeros((self.h, self.w), dtype=np.int32)
+            self.map    = np.zeros((self.h, self.w), dtype=np.int32)
+            self.front  = np.full((self.h, self.w), -1, dtype=np.int32)
+            self.buffer_cells = memoryview(self.buffer.reshape(-1))
+            self.map_cells    = memoryview(self.map.reshape(-1))
+            self.map_view = None
+
+    # Copy the map layer into the frame, drawing on top of it starts here
+    def compose(self):
+        np.copyto(self.buffer, self.map)
+
+    # Shift the map layer by whole cells; positive dx/dy moves the contents
+    # left/up. Returns the exposed (x, y, w, h) rectangles, which are cleared
+    # and need to be rasterized again.
+    def scroll(self, dx, dy):
+        w = self.w
+        h = self.h
+        m = self.map
+
+        # NumPy copies through a temporary when the two overlap
+        m[max(0, -dy):h-max(0, dy), max(0, -dx):w-max(0, dx)] = \
+            m[max(0, dy):h+min(0, dy), max(0, dx):w+min(0, dx)]
+
+        exposed = []
+        if dy > 0:
+            exposed.append((0, h-dy, w, dy))
+        elif dy < 0:
+            exposed.append((0, 0, w, -dy))
+        ry0 = max(0, -dy)
+        ry1 = min(h, h-dy)
+        if dx > 0:
+            exposed.append((w-dx, ry0, dx, ry1-ry0))
+        elif dx < 0:
+            exposed.append((0, ry0, -dx, ry1-ry0))
+
+        for (x, y, rw, rh) in exposed:
+            m[y:y+rh, x:x+rw] = 0
+        return exposed
+
+    # Text goes straight to the terminal. The cells it covers are marked so
+    # the next scanout() redraws them.
+    def addstr(self, y, x, text, attr=0):
+        self.win.addstr(y, x, text, attr)
+        if 0 <= y < self.h and x < self.w:
+            self.front[y, max(x, 0):min(x + len(text), self.w)] = -1
+
+    # Forget what's on the terminal, e.g. after it has been cleared
+    def invalidate(self):
+        if self.size is not None:
+            self.front.fill(-1)
+
+    # Braille mode draws 2x4 subpixels per cell instead of 2x2, twice the
+    # vertical resolution. The mask of a cell just gets 8 bits instead of 4,
+    # so drawing and scanout() cost the same. Needs a terminal font with the
+    # braille patterns.
+    def set_braille(self, enabled):
+        self.sub_rows = 4 if enabled else 2
+        self.glyphs = BRAILLE_GLYPHS if enabled else GLYPHS
+        # Rasterized and sent with the other mode
+        self.map_view = None
+        self.invalidate()
 
     def pixel(self, clip):
         pixel = (clip[0] * self.w, clip[1] * self.h)
@@ -218,20 +459,21 @@ class FrameBuffer:
         if (pixel[0] < 0 or pixel[1] < 0):
             return
 
-        subpixel = (pixel[0]%1, pixel[1]%1)
-        val = 1;
-        if subpixel[0] >= 0.5:
-            val <<= 1
-        if subpixel[1] >= 0.5:
-            val <<= 2
-        pxl = self.buffer[ int(pixel[1])*self.w + int(pixel[0]) ];
-        pxl = pxl|val | (pxl&0xF|(data<<8))
-        self.buffer[ int(pixel[1])*self.w + int(pixel[0]) ] = pxl;
+        # Subpixel bit is x + 2*y within the cell
+        sx = int(pixel[0]%1 * 2)
+        sy = int(pixel[1]%1 * self.sub_rows)
+        val = 1 << (sx + 2*sy)
+        cells = self.buffer_cells
+        pxl = cells[ int(pixel[1])*self.w + int(pixel[0]) ];
+        pxl = pxl|val | (data<<8)
+        cells[ int(pixel[1])*self.w + int(pixel[0]) ] = pxl;
 
     # Common DDA line drawing algorithm
     def line(self, clip_a, clip_b, data=0):
-        a = (clip_a[0] * (self.w*2), clip_a[1] * (self.h*2))
-        b = (clip_b[0] * (self.w*2), clip_b[1] * (self.h*2))
+        # In subpixels
+        rows = self.sub_rows
+        a = (clip_a[0] * (self.w*2), clip_a[1] * (self.h*rows))
+        b = (clip_b[0] * (self.w*2), clip_b[1] * (self.h*rows))
 
         dx = int(b[0] - a[0])
         dy = int(b[1] - a[1])
@@ -246,24 +488,55 @@ class FrameBuffer:
         y = a[1]
 
         for i in range(steps+1):
-            self.write_subpixel((x*0.5,y*0.5), data)
+            self.write_subpixel((x*0.5,y/rows), data)
             x += xinc
             y += yinc
-        self.write_subpixel((a[0]*0.5,a[1]*0.5), data)
-        self.write_subpixel((b[0]*0.5,b[1]*0.5), data)
-
+        self.write_subpixel((a[0]*0.5,a[1]/rows), data)
+        self.write_subpixel((b[0]*0.5,b[1]/rows), data)
+
+    # Send the cells that changed since the last scanout to the terminal.
+    #
+    # Glyphs and colors are looked up for all changed rows at once, and each
+    # row becomes one string. What's left in Python is one addstr() per run of
+    # changed cells that share a color, instead of a lookup and an addch() per
+    # cell.
     def scanout(self):
-        for x in range(self.w):
-            for y in range(self.h):
-                index = y * self.w + x
-                char = self.buffer[index]
-                block = char & 0xFF
-                match block:
-                    case 0:
-                        self.win.addch(y, x, " ", curses.color_pair(0))
-                    case _:
-                        self.win.addch(y, x, lut[block], curses.color_pair( (char>>8)+1) )
-                self.buffer[index] = 0
+        buffer = self.buffer
+        front = self.front
+        rows = np.flatnonzero((buffer != front).any(axis=1))
+        # Most rows are unchanged while panning
+        if len(rows) == 0:
+            return
+
+        cells = buffer[rows]
+        changed = cells != front[rows]
+        front[rows] = cells
+
+        glyphs = self.glyphs
+        block = cells & (len(glyphs) - 1)
+        # Empty cells are drawn blank whatever their color
+        color = np.where(block == 0, -1, cells >> 8)
+        text = glyphs[block].view(f"<U{self.w}").ravel().tolist()
+
+        # Runs start where a changed cell follows an unchanged one or a
+        # different color, and end likewise
+        same = color[:, 1:] == color[:, :-1]
+        start = changed.copy()
+        start[:, 1:] &= ~(changed[:, :-1] & same)
+        end = changed.copy()
+        end[:, :-1] &= ~(changed[:, 1:] & same)
+        (run_rows, x0) = np.nonzero(start)
+        x1 = np.nonzero(end)[1] + 1
+        colors = color[run_rows, x0]
+
+        # Attribute per color, looked up once per frame instead of per cell
+        attrs = {-1: self.color_pair(0)}
+        for (i, y, a, b, c) in zip(run_rows.tolist(), rows[run_rows].tolist(),
+                x0.tolist(), x1.tolist(), colors.tolist()):
+            attr = attrs.get(c)
+            if attr is None:
+                attr = attrs[c] = self.color_pair(c+1)
+            self.win.addstr(y, a, text[i][a:b], attr)
 
 
 class Camera:
@@ -273,102 +546,310 @@ class Camera:
         self.bbox = [0,0,0,0]
         self.aspect = 1.0
 
-    # Converts GPS to clip space
+        # Size of a character cell in Mercator units, and the global grid
+        # position of the top left cell on screen. See raster.py
+        self.cell = [1.0, 2.0]
+        self.col = 0
+        self.row = 0
+
+        # Cells per 360 degrees of longitude. The cell size is picked so this
+        # is a whole number, then the map repeats every world_cols columns.
+        self.world_cols = 1
+
+        # Copies of the world in view, as clip space x offsets from the one
+        # project_gps() returns. Valid after update_clip().
+        self.copies = [0.0]
+
+        # How the globe is flattened onto the screen, see MercatorProjection
+        self.projection = MercatorProjection()
+
+    # Snapshot of the current raster placement, valid after update_clip().
+    # None if the map can't be scrolled, eg. on the globe.
+    def view(self):
+        if not self.projection.flat:
+            return None
+        return (self.cell[0], self.col, self.row)
+
+    # If the current view is the given one moved by whole cells, return the
+    # move as (dx, dy) in cells, otherwise None. Crossing the antimeridian
+    # moves the camera by a whole world, which is no move at all.
+    def translation_from(self, view):
+        if view is None or view[0] != self.cell[0]:
+            return None
+        w = self.world_cols
+        dx = (self.col - view[1] + w//2) % w - w//2
+        return (dx, self.row - view[2])
+
+    # Converts GPS to clip space. None if the point can't be seen, eg. it's
+    # on the far side of the globe.
     def project_gps(self, gps):
-        x = gps[0]
-        y = gps[1]
-        x,y = gps_to_mercator(gps)
-        point = [
-               (x - self.offset[0])/self.scale[0],
-           1.0-(y - self.offset[1])/self.scale[1],
-        ]
-        return point
+        return self.projection.project_gps(self, gps)
 
+    # Longitude is kept within -180..180, so panning goes round and round
     def update_clip(self, fb):
-        self.aspect = fb.w / fb.h / 2.0
+        self.gps[0] = (self.gps[0] + 180.0) % 360.0 - 180.0
+        self.projection.update_clip(self, fb)
 
-        x,y = gps_to_mercator(self.gps)
+    # Switch between the flat map and the globe
+    def toggle_projection(self):
+        if self.projection.flat:
+            from globe import OrthographicProjection
+            self.projection = OrthographicProjection()
+        else:
+            self.projection = MercatorProjection()
 
-        bbox = [
-            x - self.zoom * self.aspect, y - self.zoom,
-            x + self.zoom * self.aspect, y + self.zoom,
-        ]
 
-        self.scale  = [(bbox[2] - bbox[0]), (bbox[3] - bbox[1])]
-        self.offset = [bbox[0], bbox[1]]
-        self.bbox = bbox;
+# Projections
+#
+# A projection places the map on the screen for a camera. It has:
+# flat                    - True if the map is drawn on the global cell grid
+#                           (raster.py) and can be tiled and scrolled
+# update_clip(cam, fb)    - set up for a frame
+# project_gps(cam, gps)   - GPS to clip space, or None if not visible
+#
+# update_clip() also sets cam.copies, the world copies to draw.
+#
+# Projections that aren't flat also have render(cam, fb, geom), which draws
+# the whole map layer (see globe.py).
+
+class MercatorProjection:
+    name = "Mercator"
+    flat = True
+
+    def project_gps(self, cam, gps):
+        x,y = gps_to_mercator(gps)
+        point = [
+               (x - cam.offset[0])/cam.scale[0],
+           1.0-(y - cam.offset[1])/cam.scale[1],
+        ]
+        return point
 
+    def update_clip(self, cam, fb):
+        cam.aspect = fb.w / fb.h / 2.0
 
+        x,y = gps_to_mercator(cam.gps)
 
-class MapRenderer:
-    def __init__(self, fb):
-        self.fb = fb
-        self.win = fb.win
+        # Cell size that fits the world in a whole number of columns, so the
+        # copies of the world line up with the cell grid. Changes the zoom by
+        # less than a cell's worth.
+        cam.world_cols = max(1, round(360.0 * fb.h / cam.zoom))
+        cell_w = 360.0 / cam.world_cols
+        cam.cell = [cell_w, 2.0 * cell_w]
 
-        # Load map data
-        self.sf_low  = shapefile.Reader("./data/ne_110m_admin_0_countries/ne_110m_admin_0_countries")
-        #self.sf_mid  = shapefile.Reader("./data/ne_50m_admin_0_countries/ne_50m_admin_0_countries")
-        #sf_high = shapefile.Reader("./data/ne_10m_admin_0_countries/ne_10m_admin_0_countries")
+        # Snap the view to whole cells so map tiles can be copied to the
+        # screen as is. Moves the view by half a cell at most.
+        cam.col = round((x - cam.zoom * cam.aspect) / cam.cell[0])
+        cam.row = round(-(y + cam.zoom) / cam.cell[1])
 
-    def draw_map(self, cam):
-        sf = self.sf_low
-        fb = self.fb
+        left = cam.col * cam.cell[0]
+        top  = -cam.row * cam.cell[1]
 
-        #if (cam.zoom < 15.0):
-        #    sf = sf_mid
-        #if (cam.zoom < 0.5):
-        #    sf = sf_high
+        bbox = [
+            left, top - 2.0 * cam.zoom,
+            left + fb.w * cam.cell[0], top,
+        ]
 
-        shapes = sf.shapes()
+        cam.scale  = [(bbox[2] - bbox[0]), (bbox[3] - bbox[1])]
+        cam.offset = [bbox[0], bbox[1]]
+        cam.bbox = bbox;
 
-        fb.clear()
-        cam.update_clip(fb)
+        # The world spans -180..180, copy k is shifted by k turns
+        first = math.ceil((bbox[0] - 180.0) / 360.0)
+        last  = math.floor((bbox[2] + 180.0) / 360.0)
+        cam.copies = [360.0 * k / cam.scale[0] for k in range(first, last+1)]
 
-        for shape in shapes:
 
-            shape.parts.append(len(shape.points))
 
-            bmin = gps_to_mercator((shape.bbox[0], shape.bbox[1]))
-            bmax = gps_to_mercator((shape.bbox[2], shape.bbox[3]))
+# Map geometry, projected to Mercator once at load time.
+# Stored as flat arrays instead of pyshp shape objects: vertex i is
+# (x[i], y[i]), part p spans vertices parts[p] to parts[p+1], and the Mercator
+# bounding box of part p is bbox[p*4:p*4+4] (min x, min y, max x, max y).
+# lat[i] is the vertex's latitude before projecting, which gps_to_mercator()
+# clamps; x is still the longitude. The globe (globe.py) needs the real one.
+class MapGeometry:
+    __slots__ = ("x", "y", "lat", "parts", "bbox", "level", "lods")
 
-            # AABB culling
-            if (bmax[0] < cam.bbox[0]) or (bmin[0] > cam.bbox[2]) :
-                continue
-            if (bmax[1] < cam.bbox[1]) or (bmin[1] > cam.bbox[3]) :
-                continue
+    def __init__(self, shapes=()):
+        self.x = array.array('d')
+        self.y = array.array('d')
+        self.lat = array.array('d')
+        self.parts = array.array('i')
+        self.bbox = array.array('d')
 
+        # Level of detail, 0 is the full geometry. See lod().
+        self.level = 0
+        self.lods = {0: self}
 
-            for j in range(1, len(shape.parts)):
-                for i in range(shape.parts[j-1]+1, shape.parts[j]):
-                    point = shape.points[i]
+        for shape in shapes:
+            ends = list(shape.parts) + [len(shape.points)]
+            for j in range(1, len(ends)):
+                self.parts.append(len(self.x))
+                for point in shape.points[ends[j-1]:ends[j]]:
+                    x,y = gps_to_mercator(point)
+                    self.x.append(x)
+                    self.y.append(y)
+                    self.lat.append(point[1])
+                start = self.parts[-1]
+                self.bbox.extend((
+                    min(self.x[start:]), min(self.y[start:]),
+                    max(self.x[start:]), max(self.y[start:]),
+                ))
+        self.parts.append(len(self.x))
+
+    # Coarser copy of the geometry that keeps every 2**level'th vertex of
+    # each part (and always the last). Built on first use and kept.
+    def lod(self, level):
+        geom = self.lods.get(level)
+        if geom is not None:
+            return geom
+
+        geom = MapGeometry()
+        geom.level = level
+        geom.parts = array.array('i')
+        step = 2 ** level
+        for p in range(len(self.parts)-1):
+            start = self.parts[p]
+            end = self.parts[p+1]
+            geom.parts.append(len(geom.x))
+            keep = list(range(start, end-1, step)) + [end-1]
+            geom.x.extend(self.x[i] for i in keep)
+            geom.y.extend(self.y[i] for i in keep)
+            geom.lat.extend(self.lat[i] for i in keep)
+        geom.parts.append(len(geom.x))
+        # Fewer vertices, the old boxes still cover them
+        geom.bbox = self.bbox
+
+        self.lods[level] = geom
+        return geom
+
+    # Bytes of vertex data, this level only
+    def nbytes(self):
+        return sum(a.itemsize * len(a) for a in (self.x, self.y, self.lat, self.parts, self.bbox))
+
+
+# Load map data. Called once from a loader thread, see loader.py
+def load_map():
+    # pyshp is only needed here, keep it off the startup path
+    import shapefile
+
+    sf_low = shapefile.Reader("./data/ne_110m_admin_0_countries/ne_110m_admin_0_countries")
+    #sf_mid  = shapefile.Reader("./data/ne_50m_admin_0_countries/ne_50m_admin_0_countries")
+    #sf_high = shapefile.Reader("./data/ne_10m_admin_0_countries/ne_10m_admin_0_countries")
+
+    # One shape at a time, pyshp's point lists don't all need to exist at once
+    geom = MapGeometry(sf_low.iterShapes())
+    sf_low.close()
+    return geom
 
-                    vertex_a = cam.project_gps(point)
 
-                    point = shape.points[i-1]
-                    vertex_b = cam.project_gps(point)
+class MapRenderer:
+    # tiles can be a TileCache shared with other renderers of the same map.
+    # quality (a QualityController) picks the map's level of detail.
+    def __init__(self, fb, assets, tiles=None, quality=None):
+        self.fb = fb
+        self.win = fb.win
+        self.assets = assets
+        self.tiles = tiles if tiles is not None else TileCache()
+        self.quality = quality
+        # Level of detail the map layer was drawn with
+        self.level = 0
+
+        # Parallel rasterizer, None unless turned on with set_parallel()
+        self.bands = None
+
+    # False until the map data has been loaded in the background
+    def ready(self):
+        return self.assets.map_ready()
+
+    # Opt-in: rasterize full frames on a pool of worker processes instead of
+    # from the tile cache. Worth it for large terminals.
+    def set_parallel(self, enabled):
+        if enabled and self.bands is None:
+            from bands import BandRenderer
+            self.bands = BandRenderer(self.assets.map())
+        elif not enabled and self.bands is not None:
+            self.bands.close()
+            self.bands = None
+        self.fb.map_view = None
+
+    def close(self):
+        self.set_parallel(False)
 
-                    linebbox = (
-                        min(vertex_a[0], vertex_b[0]), min(vertex_a[1], vertex_b[1]),
-                        max(vertex_a[0], vertex_b[0]), max(vertex_a[1], vertex_b[1]),
-                    )
+    def draw_map(self, cam):
+        fb = self.fb
 
-                    # Cull individual lines
-                    if (linebbox[2] < 0.0) or (linebbox[0] > 1.0) :
-                        continue
-                    if (linebbox[3] < 0.0) or (linebbox[1] > 1.0) :
-                        continue
+        fb.clear()
+        cam.update_clip(fb)
 
-                    fb.line(vertex_a, vertex_b)
-                    #fb.pixel(vertex_a)
-                    fb.pixel(vertex_b)
+        # Map still loading, draw an empty map for now
+        if not self.ready():
+            fb.compose()
+            return
 
+        geom = self.assets.map()
+        if self.quality is not None:
+            geom = geom.lod(self.quality.get("lod"))
+        if geom.level != self.level:
+            self.level = geom.level
+            fb.map_view = None
+
+        # The globe is drawn from scratch every frame
+        if not cam.projection.flat:
+            fb.map.fill(0)
+            cam.projection.render(cam, fb, geom)
+            fb.map_view = None
+            fb.compose()
+            return
 
-    def draw_waypoints(self, cam, waypoints):
-        last = cam.project_gps(waypoints[0])
-        for i in range(1, len(waypoints)):
-            cur = cam.project_gps(waypoints[i])
-            self.fb.line(last, cur, 1)
-            last = cur
+        # Pure pan by whole cells: shift what we already have and only fill in
+        # the strips that scrolled into view. Otherwise rebuild the whole
+        # layer. Either way pixels come from cached tiles, only tiles never
+        # seen at this zoom level are rasterized.
+        move = cam.translation_from(fb.map_view)
+        if move is not None and abs(move[0]) < fb.w and abs(move[1]) < fb.h:
+            if move != (0, 0):
+                for (x, y, w, h) in fb.scroll(move[0], move[1]):
+                    self.tiles.blit(geom, cam.cell[0], cam.cell[1],
+                        cam.col + x, cam.row + y, w, h, fb.map_cells, fb.w, y*fb.w + x, fb.sub_rows)
+        elif self.bands is not None:
+            self.bands.render(geom, cam.cell[0], cam.cell[1], cam.col, cam.row, fb.w, fb.h, fb.map, fb.sub_rows)
+        else:
+            fb.map.fill(0)
+            self.tiles.blit(geom, cam.cell[0], cam.cell[1], cam.col, cam.row, fb.w, fb.h, fb.map_cells,
+                sub_rows=fb.sub_rows)
+        fb.map_view = cam.view()
+        fb.compose()
+
+
+    # Great circle from gps_a to gps_b, tolerance in cells, see
+    # geodesic_polylines()
+    def draw_geodesic(self, cam, gps_a, gps_b, data=1, tolerance=0.5):
+        for points in geodesic_polylines(cam, self.fb, gps_a, gps_b, tolerance):
+            self.draw_waypoints(cam, points, data)
+
+    # Any path with continuous longitudes, eg. a range circle
+    def draw_path(self, cam, points, data=1):
+        for piece in split_antimeridian(points):
+            self.draw_waypoints(cam, piece, data)
+
+    # Segments with an end out of sight (back of the globe) are left out.
+    # The points are projected once; the other copies of the world in view
+    # get the same points shifted sideways.
+    def draw_waypoints(self, cam, waypoints, data=1):
+        points = [cam.project_gps(gps) for gps in waypoints]
+        xs = [p[0] for p in points if p is not None]
+        if not xs:
+            return
+        x0 = min(xs)
+        x1 = max(xs)
+        for offset in cam.copies:
+            if x1 + offset < 0.0 or x0 + offset > 1.0:
+                continue
+            last = points[0]
+            for cur in points[1:]:
+                if last is not None and cur is not None:
+                    self.fb.line((last[0] + offset, last[1]), (cur[0] + offset, cur[1]), data)
+                last = cur
 
 
 
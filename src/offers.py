@@ -0,0 +1,71 @@
+# Offers.py
+
+# What the customer menu shows about the customers waiting at an airport.
+#
+# The menu redraws on every keystroke, and its map passes used to ask the
+# database for the customers again, then for every destination's coordinates,
+# and work out every route again. CustomerOffers gathers all of that once per
+# airport visit: destinations, their types and distances come from the airport
+# index, so scrolling the list doesn't touch the database at all.
+#
+# Routes are great circles refined for the view (see geodesic_polylines()),
+# so they're kept for the camera view they were built for and only redone when
+# it changes, eg. on zoom.
+#
+# A CustomerOffers is stale once the player moves on or customers are
+# generated, accepted or dropped. GameState.offers drops it on those events,
+# see events.py.
+
+from map import geodesic_polylines, Waypoints
+
+
+class Offer:
+    __slots__ = ("number", "customer", "xy", "type", "distance")
+
+    def __init__(self, number, customer, xy, kind, distance):
+        # Position in the menu, starting from 1
+        self.number = number
+        self.customer = customer
+        self.xy = xy
+        self.type = kind
+        self.distance = distance
+
+
+class CustomerOffers:
+    def __init__(self, db, airports, icao):
+        self.icao = icao
+        self.origin = db.airport_xy_icao(icao)
+
+        customers = db.customers_from_airport(icao)
+        rows = [airports.rows[customer.destination] for customer in customers]
+        distances = airports.distances(icao, rows) if rows else []
+
+        self.offers = []
+        for (i, customer) in enumerate(customers):
+            row = rows[i]
+            self.offers.append(Offer(
+                i+1, customer,
+                [airports.lon[row], airports.lat[row]],
+                airports.type[row],
+                float(distances[i]),
+            ))
+
+        # Route polylines and the view they were refined for
+        self.routes = None
+        self.routes_view = None
+
+    # Offers the player can still accept
+    def waiting(self):
+        return [offer for offer in self.offers if not offer.customer.accepted]
+
+    # Polylines of every route, for drawing with cam (after update_clip())
+    def route_polylines(self, cam, fb):
+        # No view to key on for the globe, it's refined every time
+        view = (cam.view(), fb.w, fb.h)
+        if self.routes is None or view != self.routes_view or view[0] is None:
+            self.routes = []
+            for offer in self.offers:
+                for points in geodesic_polylines(cam, fb, self.origin, offer.xy):
+                    self.routes.append(Waypoints(points))
+            self.routes_view = view
+        return self.routes
@@ -1,6 +1,6 @@
 import textwrap
 import curses
-import time
+import loader
 
 # View menu_fly() function in main.py for a simple usage example
 
@@ -40,7 +40,8 @@ class Popup:
         self.ret.append(payload)
         return
 
-    def run(self):
+    # Awaitable, returns the selected option once the player presses enter
+    async def run(self):
         game = self.game
         gfx  = game.gfx
 
@@ -51,9 +52,10 @@ class Popup:
             gfx.fb.update()
             if h >= gfx.fb.h or w >= gfx.fb.w:
                 gfx.win.clear()
+                gfx.fb.invalidate()
                 gfx.win.addstr(0,0, "Your terminal is too small.")
                 gfx.win.refresh()
-                time.sleep(0.1)
+                await game.engine.getch(0.1)
                 continue
             gfx.draw_map(game.cam)
             if self.prepass != None:
@@ -71,51 +73,57 @@ class Popup:
             if self.offscreen:
                 x = gfx.fb.w - w
 
-            gfx.win.addstr(y, x, str_edge)
+            gfx.fb.addstr(y, x, str_edge)
             y+=1
             for line in self.txt:
-                gfx.win.addstr(y, x, str_panel)
-                gfx.win.addstr(y, x+2, line)
+                gfx.fb.addstr(y, x, str_panel)
+                gfx.fb.addstr(y, x+2, line)
                 y+=1
 
-            gfx.win.addstr(y, x, str_panel)
+            gfx.fb.addstr(y, x, str_panel)
             y+=1
 
             for i in range(len(self.cmd)):
                 line = self.cmd[i]
-                gfx.win.addstr(y, x, str_panel)
-                gfx.win.addstr(y, x+2, ("> " if i==sel else "  ") + line)
+                gfx.fb.addstr(y, x, str_panel)
+                gfx.fb.addstr(y, x+2, ("> " if i==sel else "  ") + line)
                 y+=1
 
-            gfx.win.addstr(y, x, str_panel)
+            gfx.fb.addstr(y, x, str_panel)
             y+=1
-            gfx.win.addstr(y, x, str_edge)
+            gfx.fb.addstr(y, x, str_edge)
 
             gfx.win.refresh()
+            loader.first_frame()
 
             # Input handling
-            ch = gfx.win.getch()
-            if ch == curses.KEY_ENTER or ch == 10 or ch == 13:
-                ret = self.ret[sel]
-                if ret != None:
-                    return ret
-                return self.cmd[sel]
-            elif ch == ord("w") or ch == curses.KEY_UP:
-                sel -= 1
-            elif ch == ord("s") or ch == curses.KEY_DOWN:
-                sel += 1
-
-            elif ch == ord("x"):
-                game.cam.zoom *= 2.0
-            elif ch == ord("z"):
-                game.cam.zoom /= 2.0
-
-            sel = max(0, min(sel, len(self.cmd)-1))
+            # Every key waiting is applied before drawing again, see
+            # Engine.getkeys()
+            keys = await game.engine.getkeys()
+            for (i, ch) in enumerate(keys):
+                if ch == curses.KEY_ENTER or ch == 10 or ch == 13:
+                    # The rest are for whatever comes next
+                    game.engine.unget(keys[i+1:])
+                    ret = self.ret[sel]
+                    if ret != None:
+                        return ret
+                    return self.cmd[sel]
+                elif ch == ord("w") or ch == curses.KEY_UP:
+                    sel -= 1
+                elif ch == ord("s") or ch == curses.KEY_DOWN:
+                    sel += 1
+
+                elif ch == ord("x"):
+                    game.cam.zoom *= 2.0
+                elif ch == ord("z"):
+                    game.cam.zoom /= 2.0
+
+                sel = max(0, min(sel, len(self.cmd)-1))
 
 
 # Immediate popup, convenience function for simple things
 # Yes we procedualice OOP code, deal with it
-def impopup(game, text, options):
+async def impopup(game, text, options):
     popup = Popup(game)
 
     for line in text:
@@ -124,4 +132,4 @@ def impopup(game, text, options):
     for line in options:
         popup.add_option(line)
 
-    return popup.run()
+    return await popup.run()
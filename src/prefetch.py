@@ -0,0 +1,67 @@
+# Prefetch.py
+
+# Warms up the destination airport while a flight is animating.
+#
+# Landing used to run a chain of queries right away: the airport record, the
+# municipality for quests, and customer generation once the player opened the
+# customer menu. The prefetcher does all of that on a worker thread with its
+# own database connection as soon as the flight starts, so by the time the
+# animation ends the arrival menu has nothing left to wait for.
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+from customer import populate_airport
+
+
+class Prefetcher:
+    # customers=False skips customer generation, for games whose customers
+    # live in tables this thread's connection can't see (Database.isolate())
+    def __init__(self, assets, customers=True):
+        self.assets = assets
+        self.customers = customers
+        # One worker; the connection belongs to that thread
+        self.local = threading.local()
+        self.pool = ThreadPoolExecutor(max_workers=1, initializer=self._connect)
+
+    def _connect(self):
+        self.local.db = database.Database()
+
+    def _warm(self, icao, selected_aircraft, customers):
+        db = self.local.db
+        db.select_aircraft(selected_aircraft)
+
+        cur = db.con.cursor()
+        cur.execute("SELECT longitude_deg, latitude_deg, type, municipality FROM airport WHERE ident=?", (icao,))
+        (lon, lat, kind, municipality) = cur.fetchone()
+
+        # Customers waiting at the destination, generated the same way the
+        # customer menu would
+        if self.customers and customers:
+            populate_airport(db, icao, self.assets.airports())
+
+        return {
+            "icao": icao,
+            "xy": [lon, lat],
+            "type": kind,
+            "municipality": municipality,
+        }
+
+    # Start warming icao for a player flying selected_aircraft, returns a
+    # job to pass to wait(). customers=False leaves customer generation to
+    # the game, eg. when they're kept in a CustomerStore (demand.py) that
+    # only sees customers made through the game's own connection.
+    def start(self, icao, selected_aircraft, customers=True):
+        return self.pool.submit(self._warm, icao, selected_aircraft, customers)
+
+    # Await a job from start(). Returns the airport record, or None if
+    # prefetching failed and the caller should do the work itself.
+    async def wait(self, engine, job):
+        try:
+            return await engine.wait(job)
+        except Exception:
+            return None
+
+    def close(self):
+        self.pool.shutdown()
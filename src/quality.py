@@ -0,0 +1,75 @@
+# Quality.py
+
+# Keeps animations and the map screens within a frame time budget.
+#
+# How long a frame takes depends on the zoom, the terminal size and the
+# terminal itself. The controller keeps the last few frame times; when they
+# average over the budget it steps down to a cheaper quality level, and when
+# there's plenty of room it steps back up. Steps only happen after a full
+# window of samples at the current level, so it doesn't flap between two.
+#
+# The levels, best first. Internal resolution is not one of the knobs: the
+# map is drawn on the terminal's own cell grid and most of a frame goes into
+# sending cells to the terminal, so the last level skips frames instead.
+
+import time
+
+LEVELS = [
+    # labels: 2 = large and medium airports, 1 = large only, 0 = none
+    # tolerance: how far (in cells) drawn great circles may stray from the
+    # true curve, see geodesic_polylines()
+    # lod: map detail, see MapGeometry.lod()
+    # frame_skip: draw every Nth animation frame
+    {"labels": 2, "tolerance": 0.5, "lod": 0, "frame_skip": 1},
+    {"labels": 1, "tolerance": 0.5, "lod": 0, "frame_skip": 1},
+    {"labels": 1, "tolerance": 1.0, "lod": 1, "frame_skip": 1},
+    {"labels": 0, "tolerance": 2.0, "lod": 2, "frame_skip": 1},
+    {"labels": 0, "tolerance": 3.0, "lod": 2, "frame_skip": 2},
+]
+
+# Seconds per frame
+FRAME_BUDGET = 1.0 / 30
+
+# Step back up when frames average under this share of the budget
+HEADROOM = 0.5
+
+# Frames measured before deciding
+WINDOW = 12
+
+
+class QualityController:
+    # A disabled controller stays at the best level, eg. for replays, which
+    # must draw the same frames however fast the machine is
+    def __init__(self, enabled=True, budget=FRAME_BUDGET):
+        self.enabled = enabled
+        self.budget = budget
+        self.level = 0
+        self.times = []
+        self.t_frame = None
+
+    def get(self, key):
+        return LEVELS[self.level][key]
+
+    def begin_frame(self):
+        self.t_frame = time.perf_counter()
+
+    def end_frame(self):
+        if self.t_frame is None:
+            return
+        self.times.append(time.perf_counter() - self.t_frame)
+        self.t_frame = None
+        if len(self.times) >= WINDOW:
+            self.adjust(sum(self.times) / len(self.times))
+            self.times.clear()
+
+    def adjust(self, average):
+        if not self.enabled:
+            return
+        if average > self.budget and self.level < len(LEVELS)-1:
+            self.level += 1
+        elif average < self.budget * HEADROOM and self.level > 0:
+            self.level -= 1
+
+    def describe(self):
+        settings = ", ".join(f"{key} {value}" for (key, value) in LEVELS[self.level].items())
+        return f"Quality level {self.level}/{len(LEVELS)-1}: {settings}"
@@ -1,6 +1,7 @@
 # This file has quests
 
 from customer import Customer
+from events import QuestFlagChanged
 from popup import Popup, impopup
 
 class QuestManager:
@@ -13,6 +14,7 @@ class QuestManager:
     def add_flag(self, flag):
         cur = self.db.con.cursor()
         cur.execute("REPLACE INTO quest (flag) VALUES (?)", (flag,))
+        self.game.events.publish(QuestFlagChanged(flag))
 
     def has_flag(self, flag):
         cur = self.db.con.cursor()
@@ -22,6 +24,7 @@ class QuestManager:
     def del_flag(self, flag):
         cur = self.db.con.cursor()
         cur.execute("DELETE FROM quest WHERE flag = ?", (flag,))
+        self.game.events.publish(QuestFlagChanged(flag))
 
     def all_flags(self):
         cur = self.db.con.cursor()
@@ -43,10 +46,13 @@ class QuestManager:
                 self.add_flag(flag)
             self.del_flag("test_del")
 
-    def arrived_at_airport(self):
+    # municipality can be passed in if it's already known, eg. prefetched
+    # during the flight
+    def arrived_at_airport(self, municipality=None):
         self.update()
         icao = self.game.airport
-        municipality = self.db.airport_municipality(self.game.airport)
+        if municipality is None:
+            municipality = self.db.airport_municipality(self.game.airport)
 
         if self.has_flag("je_new_york") and municipality == "New York":
             self.del_flag("je_new_york")
@@ -58,7 +64,7 @@ class QuestManager:
             customer.reward = 50000
             customer.save()
 
-    def completed_customer_flight(self, customer):
+    async def completed_customer_flight(self, customer):
         if customer.name == "Jeffrey Epstein":
             popup = Popup(self.game)
             popup.w = 50
@@ -79,7 +85,7 @@ class QuestManager:
             popup.add_text('  ..--=#%%%%%#*+===                ')
             popup.add_option("Accept")
             popup.add_option("Decline")
-            ret = popup.run()
+            ret = await popup.run()
 
             if (ret == "Accept"):
                 self.add_flag("je_accept")
@@ -102,7 +108,7 @@ class QuestManager:
                 popup.add_text('  :-*+*%%%%%%%*+*=-                ')
                 popup.add_text('  ..--=#%%%%%#*+===                ')
                 popup.add_option("Continue")
-                ret = popup.run()
+                ret = await popup.run()
 
             return True
 
@@ -0,0 +1,18 @@
+# Randomness.py
+
+# The one random number generator all game logic draws from. Seeding it
+# makes customer names, destinations and rewards repeatable, which together
+# with input recording (engine.py, replay.py) makes whole sessions
+# repeatable.
+
+import random
+
+source = random.Random()
+
+def seed(value):
+    source.seed(value)
+
+# A fresh seed for sessions that didn't ask for one, so they can still be
+# recorded and replayed
+def new_seed():
+    return random.SystemRandom().randrange(2**32)
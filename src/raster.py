@@ -0,0 +1,125 @@
+# Raster.py
+
+# Rasterizes the Mercator map geometry (see MapGeometry in map.py) into a
+# rectangular region of cells.
+#
+# All rasterization happens on one global grid: cell column = x / cell_w and
+# cell row = -y / cell_h, where x,y are Mercator coordinates. Each cell has
+# 2 x sub_rows subpixels, same as the FrameBuffer (2x2 blocks or 2x4 braille,
+# see FrameBuffer.set_braille()). Since every region uses the same grid
+# and the same line stepping, regions rasterized separately (tiles, bands,
+# strips) line up exactly when placed next to each other.
+#
+# The world repeats every 360 degrees of longitude. Regions past the
+# antimeridian get the neighbouring copy, drawn from the same vertex arrays
+# shifted by a whole turn.
+
+import math
+
+
+# Rasterize geometry into out, a flat row-major array of cols*rows cells whose
+# top left cell is (col0, row0) on the global grid. Subpixel bits are OR'ed in,
+# data goes to the bits above the subpixels like in FrameBuffer.write_subpixel.
+def rasterize(geom, cell_w, cell_h, col0, row0, cols, rows, out, data=0, sub_rows=2):
+    # Region in Mercator space, for culling whole parts
+    left   = col0 * cell_w
+    right  = (col0 + cols) * cell_w
+    top    = -row0 * cell_h
+    bottom = -(row0 + rows) * cell_h
+
+    # Region in global subpixel space
+    ox = col0 * 2
+    oy = row0 * sub_rows
+    sw = cols * 2
+    sh = rows * sub_rows
+
+    sx = 2.0 / cell_w
+    sy = -sub_rows / cell_h
+    # Subpixel row to cell row, and to the row within the cell
+    rshift = sub_rows.bit_length() - 1
+    rmask = sub_rows - 1
+
+    xs = geom.x
+    ys = geom.y
+    parts = geom.parts
+    bbox = geom.bbox
+    color = data << 8
+
+    # Copies of the world (-180..180 shifted by turn*360) overlapping the region
+    first = math.ceil((left - 180.0) / 360.0)
+    last  = math.floor((right + 180.0) / 360.0)
+    for turn in range(first, last+1):
+        shift = 360.0 * turn
+        # Region and subpixel origin relative to this copy
+        cleft  = left - shift
+        cright = right - shift
+        cox    = ox - shift * sx
+
+        for p in range(len(parts) - 1):
+            # AABB culling
+            if (bbox[p*4+2] < cleft) or (bbox[p*4+0] > cright):
+                continue
+            if (bbox[p*4+3] < bottom) or (bbox[p*4+1] > top):
+                continue
+
+            start = parts[p]
+            end   = parts[p+1]
+
+            # Region-local subpixel coordinates of the previous vertex
+            bx = xs[start] * sx - cox
+            by = ys[start] * sy - oy
+
+            for i in range(start+1, end):
+                ax = xs[i] * sx - cox
+                ay = ys[i] * sy - oy
+
+                # Cull individual lines
+                if (ax < 0 and bx < 0) or (ax >= sw and bx >= sw):
+                    bx, by = ax, ay
+                    continue
+                if (ay < 0 and by < 0) or (ay >= sh and by >= sh):
+                    bx, by = ax, ay
+                    continue
+
+                # Common DDA line drawing algorithm, from a to b
+                dx = int(bx - ax)
+                dy = int(by - ay)
+                steps = max(abs(dx), abs(dy))
+
+                if steps != 0:
+                    xinc = dx / steps
+                    yinc = dy / steps
+
+                    # Only step through the part of the line inside the region
+                    lo = 0
+                    hi = steps
+                    if xinc != 0:
+                        t0 = -ax / xinc
+                        t1 = (sw - ax) / xinc
+                        lo = max(lo, math.floor(min(t0, t1)))
+                        hi = min(hi, math.ceil(max(t0, t1)))
+                    if yinc != 0:
+                        t0 = -ay / yinc
+                        t1 = (sh - ay) / yinc
+                        lo = max(lo, math.floor(min(t0, t1)))
+                        hi = min(hi, math.ceil(max(t0, t1)))
+
+                    for j in range(lo, hi+1):
+                        x = ax + j * xinc
+                        y = ay + j * yinc
+                        if 0 <= x < sw and 0 <= y < sh:
+                            ix = int(x)
+                            iy = int(y)
+                            out[(iy>>rshift)*cols + (ix>>1)] |= (1 << ((ix&1) | ((iy&rmask)<<1))) | color
+
+                # End points
+                if 0 <= ax < sw and 0 <= ay < sh:
+                    ix = int(ax)
+                    iy = int(ay)
+                    out[(iy>>rshift)*cols + (ix>>1)] |= (1 << ((ix&1) | ((iy&rmask)<<1))) | color
+                if 0 <= bx < sw and 0 <= by < sh:
+                    ix = int(bx)
+                    iy = int(by)
+                    out[(iy>>rshift)*cols + (ix>>1)] |= (1 << ((ix&1) | ((iy&rmask)<<1))) | color
+
+                bx, by = ax, ay
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# Replay.py
+
+# Plays back a session recorded with "python ./src/main.py --record FILE".
+#
+# The game runs headless (headless.py) with the recorded RNG seed and keys,
+# on the engine's virtual clock, as fast as it can. At the end it prints the
+# game state and a hash over every frame drawn; replaying the same recording
+# twice must print the same thing. Use it to reproduce bugs and to check that
+# a change didn't alter gameplay.
+#
+# The database carries over between sessions (owned aircraft, quest flags),
+# so record and replay from the same state. --reset resets the database
+# first; record after a reset from the developer menu to match.
+#
+# --check-audit replays twice from a reset database, with and without the
+# cache audit (main.py --audit), and fails unless both end the same: the
+# audit must only watch, never change the RNG stream or anything drawn.
+#
+# Usage: python ./src/replay.py session.rec [--reset] [--check-audit]
+
+import argparse
+import asyncio
+import hashlib
+import sys
+import time
+
+import loader
+import database
+import randomness
+from engine import load_recording
+from headless import HeadlessWindow, ReplayFinished
+from main import GameState, play
+
+
+async def replay(path, reset=False, audit=False):
+    (header, keys) = load_recording(path)
+    randomness.seed(header["seed"])
+
+    if reset:
+        database.Database().reset()
+
+    # Wait for the assets so every frame is drawn the same way
+    assets = loader.Assets()
+    assets.map()
+    assets.airports()
+
+    win = HeadlessWindow([group for (t, group) in keys])
+    game = GameState(win, assets, virtual_clock=True, audit=audit)
+    if header.get("braille", False):
+        game.gfx.fb.set_braille(True)
+
+    t_start = time.perf_counter()
+    try:
+        await play(game, world=header.get("world", False))
+        finished = "quit"
+    except ReplayFinished:
+        finished = "out of keys"
+    finally:
+        game.close()
+    t_end = time.perf_counter()
+
+    return [
+        f"Replayed {win.next_key} keys, {win.frames} frames in {t_end-t_start:.2f} s ({finished})",
+        f"Airport:  {game.airport}",
+        f"Money:    {game.money}",
+        f"Aircraft: {game.db.selected_aircraft}",
+        f"Flags:    {' '.join(sorted(game.quests.all_flags()))}",
+        f"Frames:   {win.digest.hexdigest()}",
+        f"RNG:      {hashlib.sha1(repr(randomness.source.getstate()).encode()).hexdigest()}",
+    ]
+
+
+# Replay path with the audit off and on, returns the lines that differ
+async def check_audit(path):
+    plain = await replay(path, reset=True)
+    audited = await replay(path, reset=True, audit=True)
+    # The first line has the time taken
+    return [f"{a}  vs. audited  {b}" for (a, b) in zip(plain[1:], audited[1:]) if a != b]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded session")
+    parser.add_argument("recording")
+    parser.add_argument("--reset", action="store_true", help="reset the database first")
+    parser.add_argument("--check-audit", action="store_true", help="check that --audit doesn't change the replay")
+    args = parser.parse_args()
+
+    if args.check_audit:
+        differences = asyncio.run(check_audit(args.recording))
+        for line in differences:
+            print(line)
+        if differences:
+            sys.exit(1)
+        print("Replays with and without the audit match")
+        return
+
+    for line in asyncio.run(replay(args.recording, args.reset)):
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
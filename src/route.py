@@ -0,0 +1,184 @@
+# Route.py
+
+# Multi-leg route planning over the airport graph.
+#
+# Aircraft can only fly so far, so longer trips need fuel stops. The graph has
+# an edge between every pair of airports closer than the aircraft's range;
+# that's far too many edges to build up front, so neighbors are looked up on
+# demand from a spatial index instead. Paths are found with A* using great
+# circle distances on a spherical earth.
+
+import heapq
+import math
+
+EARTH_RADIUS_KM = 6371.0
+
+# Airports that can serve as fuel stops. Origin and destination can be any
+# airport.
+STOP_TYPES = ("medium_airport", "large_airport")
+
+
+def gps_to_unit(lon, lat):
+    lon = math.radians(lon)
+    lat = math.radians(lat)
+    return (
+        math.cos(lat) * math.cos(lon),
+        math.cos(lat) * math.sin(lon),
+        math.sin(lat),
+    )
+
+
+# Great circle distance between two unit vectors
+def unit_distance_km(a, b):
+    dx = a[0]-b[0]
+    dy = a[1]-b[1]
+    dz = a[2]-b[2]
+    chord = math.sqrt(dx*dx + dy*dy + dz*dz)
+    return 2.0 * EARTH_RADIUS_KM * math.asin(min(1.0, chord * 0.5))
+
+
+# Airports bucketed into a lat/lon grid, for "everything within N km" queries
+class SpatialIndex:
+    def __init__(self, airports, rows, cell_deg=2.0):
+        self.airports = airports
+        self.cell_deg = cell_deg
+        self.n_lon = int(round(360 / cell_deg))
+
+        # row -> unit vector
+        self.unit = {}
+        # (lat cell, lon cell) -> rows
+        self.cells = {}
+
+        for i in rows:
+            lon = airports.lon[i]
+            lat = airports.lat[i]
+            self.unit[i] = gps_to_unit(lon, lat)
+            key = (self.lat_cell(lat), self.lon_cell(lon))
+            self.cells.setdefault(key, []).append(i)
+
+    def lat_cell(self, lat):
+        return int(math.floor((lat + 90) / self.cell_deg))
+
+    def lon_cell(self, lon):
+        return int(math.floor((lon + 180) / self.cell_deg)) % self.n_lon
+
+    # All indexed rows within radius_km of (lon, lat), as (row, distance)
+    def within(self, lon, lat, radius_km):
+        center = gps_to_unit(lon, lat)
+        radius_deg = math.degrees(radius_km / EARTH_RADIUS_KM)
+
+        lat0 = max(-90.0, lat - radius_deg)
+        lat1 = min( 90.0, lat + radius_deg)
+
+        # Widest the circle gets in longitude; near the poles take every column
+        max_lat = max(abs(lat0), abs(lat1))
+        if max_lat >= 89.0 or radius_deg >= 90.0:
+            lon_cells = range(self.n_lon)
+        else:
+            dlon = radius_deg / math.cos(math.radians(max_lat))
+            if dlon >= 180.0:
+                lon_cells = range(self.n_lon)
+            else:
+                c0 = int(math.floor((lon - dlon + 180) / self.cell_deg))
+                c1 = int(math.floor((lon + dlon + 180) / self.cell_deg))
+                # Modulo handles the antimeridian
+                lon_cells = set(c % self.n_lon for c in range(c0, c1+1))
+
+        ret = []
+        for la in range(self.lat_cell(lat0), self.lat_cell(lat1)+1):
+            for lo in lon_cells:
+                for i in self.cells.get((la, lo), ()):
+                    d = unit_distance_km(center, self.unit[i])
+                    if d <= radius_km:
+                        ret.append((i, d))
+        return ret
+
+
+# Find a route from origin to destination (ICAO codes) where no leg is longer
+# than range_km. mode is "stops" for the fewest legs (ties broken by
+# distance) or "distance" for the shortest total distance.
+# Returns the list of airports including both ends, or None if there's no
+# route.
+def plan_route(airports, index, origin, destination, range_km, mode="stops"):
+    start = airports.rows[origin]
+    goal  = airports.rows[destination]
+    if start == goal:
+        return [origin]
+
+    goal_unit = gps_to_unit(airports.lon[goal], airports.lat[goal])
+
+    def unit(i):
+        u = index.unit.get(i)
+        if u is None:
+            u = gps_to_unit(airports.lon[i], airports.lat[i])
+        return u
+
+    # Costs are (legs, km) tuples compared in mode order
+    def cost(legs, km):
+        return (legs, km) if mode == "stops" else (km, legs)
+
+    def heuristic(i):
+        d = unit_distance_km(unit(i), goal_unit)
+        # At least this many more legs are needed, never an overestimate
+        legs = math.ceil(d / range_km) if d > 0 else 0
+        return legs, d
+
+    best = {start: (0, 0.0)}
+    came_from = {}
+    h = heuristic(start)
+    queue = [(cost(*h), 0, 0.0, start)]
+    closed = set()
+
+    while queue:
+        (_, legs, km, i) = heapq.heappop(queue)
+        if i == goal:
+            path = [i]
+            while i in came_from:
+                i = came_from[i]
+                path.append(i)
+            return [airports.ident[p] for p in reversed(path)]
+        if i in closed:
+            continue
+        closed.add(i)
+
+        neighbors = index.within(airports.lon[i], airports.lat[i], range_km)
+        d_goal = unit_distance_km(unit(i), goal_unit)
+        if d_goal <= range_km:
+            neighbors.append((goal, d_goal))
+
+        for (j, d) in neighbors:
+            if j in closed:
+                continue
+            n_legs = legs + 1
+            n_km = km + d
+            if j in best and cost(*best[j]) <= cost(n_legs, n_km):
+                continue
+            best[j] = (n_legs, n_km)
+            came_from[j] = i
+            h_legs, h_km = heuristic(j)
+            heapq.heappush(queue, (cost(n_legs + h_legs, n_km + h_km), n_legs, n_km, j))
+
+    return None
+
+
+def route_distance_km(airports, route):
+    total = 0.0
+    for k in range(1, len(route)):
+        a = airports.rows[route[k-1]]
+        b = airports.rows[route[k]]
+        total += unit_distance_km(
+            gps_to_unit(airports.lon[a], airports.lat[a]),
+            gps_to_unit(airports.lon[b], airports.lat[b]),
+        )
+    return total
+
+
+# The spatial index over fuel stops is built once per airport index
+_index_cache = {}
+
+def stop_index(airports):
+    index = _index_cache.get(id(airports))
+    if index is None or index.airports is not airports:
+        index = SpatialIndex(airports, airports.of_type(*STOP_TYPES))
+        _index_cache[id(airports)] = index
+    return index
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# Server.py
+
+# Hosts the game for many players at once over TCP. Connect with a telnet
+# client (or nc, without window size detection):
+#
+#   python ./src/server.py --port 4000
+#   telnet localhost 4000
+#
+# Every connection is a session with its own GameState running on the one
+# asyncio event loop, drawing to a TelnetWindow (an ANSI terminal, see
+# ansi.py) instead of curses. What never changes is loaded once and shared by
+# all sessions: the map geometry and the airport index (loader.Assets), the
+# rasterized map tiles and the aircraft catalog. Player progress (customers,
+# quest flags, owned aircraft) is kept in per-connection tables, see
+# Database.isolate(), and is gone when the player disconnects.
+#
+# Database queries still run on the event loop like in the single player
+# game, so a slow query stalls every session for a moment. Fine for a local
+# server with a few dozen players.
+
+import argparse
+import asyncio
+
+import loader
+import database
+from ansi import AnsiWindow, SCREEN_RESET
+from main import GameState, play, COLOR_PAIRS
+from tiles import TileCache
+
+# Telnet protocol bytes
+IAC  = 255
+DONT = 254
+DO   = 253
+WONT = 252
+WILL = 251
+SB   = 250
+SE   = 240
+
+# Telnet options
+ECHO  = 1
+SGA   = 3
+NAWS  = 31
+
+# We echo (that is, don't), the client sends keys as they're typed and
+# reports its window size
+NEGOTIATE = bytes((IAC, WILL, ECHO, IAC, WILL, SGA, IAC, DO, NAWS))
+
+# Frames are dropped while a client has this much output still unsent
+MAX_BACKLOG = 256 * 1024
+
+# Size assumed until the client reports its own
+DEFAULT_SIZE = (24, 80)
+
+
+class SessionClosed(Exception):
+    pass
+
+
+# An AnsiWindow on the other end of a socket
+class TelnetWindow(AnsiWindow):
+    def __init__(self, writer):
+        self.writer = writer
+        self.closed = False
+        # Bytes of an unfinished telnet command
+        self.telnet_pending = b""
+
+        super().__init__(*DEFAULT_SIZE, COLOR_PAIRS)
+
+    def refresh(self):
+        if self.writer.transport.get_write_buffer_size() > MAX_BACKLOG:
+            return
+        data = self.render()
+        if data:
+            self.writer.write(data.encode())
+
+    def getch(self):
+        if self.input:
+            return self.input.popleft()
+        if self.closed:
+            raise SessionClosed()
+        return -1
+
+    # Take the telnet commands out of what the client sent, the rest is keys
+    def feed(self, data):
+        data = self.telnet_pending + data
+        keys = bytearray()
+        i = 0
+        n = len(data)
+        while i < n:
+            b = data[i]
+            if b != IAC:
+                keys.append(b)
+                i += 1
+                continue
+
+            if i+1 >= n:
+                break
+            cmd = data[i+1]
+            if cmd in (WILL, WONT, DO, DONT):
+                if i+2 >= n:
+                    break
+                i += 3
+            elif cmd == SB:
+                end = data.find(bytes((IAC, SE)), i+2)
+                if end == -1:
+                    break
+                self.subnegotiation(data[i+2:end].replace(bytes((IAC, IAC)), bytes((IAC,))))
+                i = end+2
+            else:
+                i += 2
+
+        self.telnet_pending = data[i:]
+        super().feed(bytes(keys))
+
+    def subnegotiation(self, payload):
+        if len(payload) >= 5 and payload[0] == NAWS:
+            w = (payload[1] << 8) | payload[2]
+            h = (payload[3] << 8) | payload[4]
+            if w > 0 and h > 0 and (h, w) != (self.h, self.w):
+                self.resize(h, w)
+
+
+async def read_input(reader, win):
+    try:
+        while True:
+            data = await reader.read(4096)
+            if not data:
+                break
+            win.feed(data)
+    except ConnectionError:
+        pass
+    win.closed = True
+
+
+def open_database():
+    db = database.Database()
+    db.isolate()
+    return db
+
+
+async def session(reader, writer, assets, tiles):
+    win = TelnetWindow(writer)
+    writer.write(NEGOTIATE)
+    reading = asyncio.create_task(read_input(reader, win))
+
+    # Connecting takes a moment, don't hold up the other sessions
+    db = await asyncio.get_running_loop().run_in_executor(None, open_database)
+    game = GameState(win, assets, db=db, tiles=tiles)
+    win.on_resize = game.engine.redraw
+
+    try:
+        await play(game)
+    except (SessionClosed, ConnectionError):
+        pass
+    finally:
+        game.close()
+        db.con.close()
+        reading.cancel()
+        if not writer.is_closing():
+            writer.write(SCREEN_RESET.encode())
+            writer.close()
+
+
+async def serve(host, port, max_sessions):
+    # Loaded once, shared by every session
+    assets = loader.Assets()
+    tiles = TileCache()
+
+    sessions = set()
+
+    async def connected(reader, writer):
+        if len(sessions) >= max_sessions:
+            writer.write(b"Server full, try again later.\r\n")
+            writer.close()
+            return
+        task = asyncio.current_task()
+        sessions.add(task)
+        try:
+            await session(reader, writer, assets, tiles)
+        finally:
+            sessions.discard(task)
+
+    server = await asyncio.start_server(connected, host, port)
+    print(f"Listening on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multiplayer game server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4000)
+    parser.add_argument("--max-sessions", type=int, default=50)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.max_sessions))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
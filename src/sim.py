@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# Sim.py
+
+# Headless economy simulator for balancing.
+#
+# Plays thousands of scripted careers through the same customer generation,
+# payout and aircraft purchase rules the game uses (customer.py, aircraft.py),
+# without curses or the game tables. Careers are spread over a process pool
+# and the results are summed up as money curves and time-to-buy per aircraft.
+#
+# Needs the airport table from the database, nothing else is touched.
+#
+# Usage: python ./src/sim.py --careers 2000 --flights 200
+#
+# The scripted player is simple: at every airport take the best paying
+# customer, fly there, and buy the cheapest aircraft not owned yet as soon as
+# it's affordable. Customers are generated fresh on every visit, in the game
+# they stay at the airport until taken.
+
+import argparse
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import aircraft
+from customer import customer_counts, generate_offer
+
+START_AIRPORT = "EFHK"
+
+# Worker process state
+_airports = None
+
+
+def _init_worker(airports):
+    global _airports
+    _airports = airports
+
+
+def run_career(airports, seed, flights, start_airport=START_AIRPORT):
+    rng = random.Random(seed)
+
+    money = aircraft.START_MONEY
+    owned = set(row[1] for row in aircraft.CATALOG if row[10])
+    stats = aircraft.catalog_stats(aircraft.selected_aircraft)
+    here = start_airport
+    hours = 0.0
+
+    # Money after each flight, index 0 is the start
+    curve = [money]
+    # Aircraft name -> (flights, hours) when it was bought
+    bought = {}
+
+    shop = sorted(aircraft.CATALOG, key=lambda row: row[9])
+
+    for flight in range(1, flights+1):
+        tier1, tier2 = customer_counts(airports.type[airports.rows[here]], stats["category"])
+        offers = []
+        for (tier, count) in ((1, tier1), (2, tier2)):
+            for i in range(count):
+                offer = generate_offer(airports, here, tier, stats, rng)
+                if offer is not None:
+                    offers.append(offer)
+
+        if offers:
+            (dest, km, reward) = max(offers, key=lambda offer: offer[2])
+        else:
+            # Nobody to fly, move somewhere busier for free
+            offer = generate_offer(airports, here, 2, stats, rng)
+            if offer is None:
+                break
+            (dest, km, reward) = (offer[0], offer[1], 0)
+
+        hours += km / stats["speed_kmh"]
+        money += reward
+        here = dest
+
+        for row in shop:
+            if row[1] in owned:
+                continue
+            cost = aircraft.purchase_cost(row[9])
+            if money >= cost:
+                money -= cost
+                owned.add(row[1])
+                stats = aircraft.catalog_stats(row[1])
+                bought[row[1]] = (flight, hours)
+            break
+
+        curve.append(money)
+
+    # Stranded careers keep their last balance
+    curve.extend([curve[-1]] * (flights + 1 - len(curve)))
+    return curve, bought
+
+
+def _run_batch(seeds, flights):
+    return [run_career(_airports, seed, flights) for seed in seeds]
+
+
+def simulate(airports, careers, flights, workers=None, seed=0, batch=50):
+    seeds = [seed + i for i in range(careers)]
+    batches = [seeds[i:i+batch] for i in range(0, careers, batch)]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(airports,)) as pool:
+        for batch_results in pool.map(_run_batch, batches, [flights] * len(batches)):
+            results.extend(batch_results)
+    return results
+
+
+def report(results, flights):
+    curves = np.array([curve for (curve, bought) in results], dtype=np.float64)
+    lines = []
+
+    lines.append(f"{len(results)} careers, {flights} flights each")
+    lines.append("")
+    lines.append("Money after N flights")
+    lines.append(f"{'flights':>8} {'p10':>14} {'median':>14} {'p90':>14}")
+    for n in sorted(set([0, 1, 5, 10, 25, 50, 100, 200, 500, 1000, flights])):
+        if n > flights:
+            continue
+        p10, p50, p90 = np.percentile(curves[:, n], [10, 50, 90])
+        lines.append(f"{n:>8} {p10:>14,.0f} {p50:>14,.0f} {p90:>14,.0f}")
+
+    lines.append("")
+    lines.append("Time to buy")
+    lines.append(f"{'aircraft':20} {'careers':>8} {'flights':>8} {'hours':>8}")
+    for row in aircraft.CATALOG:
+        name = row[1]
+        if row[10]:
+            continue
+        times = [bought[name] for (curve, bought) in results if name in bought]
+        if not times:
+            lines.append(f"{name:20} {0:>8.0%}")
+            continue
+        share = len(times) / len(results)
+        median_flights = np.median([t[0] for t in times])
+        median_hours = np.median([t[1] for t in times])
+        lines.append(f"{name:20} {share:>8.0%} {median_flights:>8.0f} {median_hours:>8.1f}")
+
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless economy simulator")
+    parser.add_argument("--careers", type=int, default=1000)
+    parser.add_argument("--flights", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    import database
+    from airports import load_airports
+    con = database.connect()
+    airports = load_airports(con)
+    con.close()
+
+    results = simulate(airports, args.careers, args.flights, args.workers, args.seed)
+    for line in report(results, args.flights):
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# Terminal.py
+
+# The terminal the game was started in, drawn with ANSI escapes (see ansi.py)
+# instead of curses: "python ./src/main.py --ansi". Needs a POSIX terminal
+# for cbreak mode and resize signals, so it's kept out of ansi.py, which the
+# game server imports on every platform.
+
+import os
+import select
+import signal
+import sys
+import termios
+import tty
+
+from ansi import AnsiWindow, SCREEN_RESET
+
+
+# The terminal the game was started in
+class TerminalWindow(AnsiWindow):
+    def __init__(self, color_pairs):
+        self.fd_in = sys.stdin.fileno()
+        self.fd_out = sys.stdout.fileno()
+
+        # Keys arrive as typed and aren't echoed, Ctrl-C still works
+        self.saved_mode = termios.tcgetattr(self.fd_in)
+        tty.setcbreak(self.fd_in)
+
+        size = os.get_terminal_size(self.fd_out)
+        super().__init__(size.lines, size.columns, color_pairs)
+
+        # Resizes are picked up between frames, see getch()
+        self.resized = False
+        self.saved_winch = signal.signal(signal.SIGWINCH, self._winch)
+
+    def _winch(self, signum, frame):
+        self.resized = True
+
+    def refresh(self):
+        data = memoryview(self.render().encode())
+        while data:
+            written = os.write(self.fd_out, data)
+            data = data[written:]
+
+    def getch(self):
+        if self.resized:
+            self.resized = False
+            size = os.get_terminal_size(self.fd_out)
+            self.resize(size.lines, size.columns)
+
+        if not self.input and select.select([self.fd_in], [], [], 0)[0]:
+            self.feed(os.read(self.fd_in, 1024))
+        return super().getch()
+
+    def close(self):
+        signal.signal(signal.SIGWINCH, self.saved_winch)
+        os.write(self.fd_out, SCREEN_RESET.encode())
+        termios.tcsetattr(self.fd_in, termios.TCSADRAIN, self.saved_mode)
@@ -0,0 +1,99 @@
+# Tiles.py
+
+# Cache of pre-rasterized map tiles.
+#
+# The map is cut into square tiles of TILE x TILE cells on the global cell
+# grid (see raster.py). A tile is rasterized once for a given zoom level and
+# then reused, so panning the camera only has to copy tiles into the
+# framebuffer instead of drawing every coastline again.
+#
+# The zoom level is identified by the Mercator width of one cell, which is
+# what determines the raster; the same zoom on a differently sized terminal is
+# a different level. Braille cells (sub_rows 4) are rasterized differently and
+# cached separately.
+
+import array
+from collections import OrderedDict
+
+from raster import rasterize
+
+# Cells per tile side
+TILE = 32
+
+# Cache size limit, in bytes of tile data
+MAX_BYTES = 16 * 1024 * 1024
+
+# Tiles with nothing on them (open ocean) are stored as this, they cost
+# nothing to keep and nothing to blit.
+EMPTY = None
+
+
+class TileCache:
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        # (detail, level, sub_rows, tx, ty) -> tile, least recently used
+        # first. Detail is the geometry's level of detail, see
+        # MapGeometry.lod()
+        self.tiles = OrderedDict()
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self.tiles.clear()
+        self.bytes = 0
+
+    def get(self, geom, cell_w, cell_h, tx, ty, sub_rows=2):
+        key = (geom.level, cell_w, sub_rows, tx, ty)
+        if key in self.tiles:
+            tile = self.tiles[key]
+            self.tiles.move_to_end(key)
+            self.hits += 1
+            return tile
+
+        self.misses += 1
+        tile = array.array('i', bytes(4 * TILE * TILE))
+        rasterize(geom, cell_w, cell_h, tx*TILE, ty*TILE, TILE, TILE, tile, sub_rows=sub_rows)
+        if not any(tile):
+            tile = EMPTY
+        else:
+            self.bytes += tile.itemsize * len(tile)
+
+        self.tiles[key] = tile
+        self.evict()
+        return tile
+
+    def evict(self):
+        # Empty tiles are free but still shouldn't pile up without bound
+        max_tiles = 4 * self.max_bytes // (4 * TILE * TILE)
+        while self.tiles and (self.bytes > self.max_bytes or len(self.tiles) > max_tiles):
+            key, tile = self.tiles.popitem(last=False)
+            if tile is not EMPTY:
+                self.bytes -= tile.itemsize * len(tile)
+
+    # Copy the tiles covering the cell rectangle (col0, row0, w, h) into a flat
+    # row-major buffer of w*h cells. The buffer must already be cleared.
+    # A rectangle inside a larger buffer can be filled by passing the larger
+    # buffer's row stride and the index of the rectangle's first cell as base.
+    def blit(self, geom, cell_w, cell_h, col0, row0, w, h, buffer, stride=None, base=0, sub_rows=2):
+        if stride is None:
+            stride = w
+        for ty in range(row0 // TILE, (row0 + h - 1) // TILE + 1):
+            for tx in range(col0 // TILE, (col0 + w - 1) // TILE + 1):
+                tile = self.get(geom, cell_w, cell_h, tx, ty, sub_rows)
+                if tile is EMPTY:
+                    continue
+
+                # Overlap of the tile and the destination, in global cells
+                x0 = max(col0, tx * TILE)
+                x1 = min(col0 + w, tx * TILE + TILE)
+                y0 = max(row0, ty * TILE)
+                y1 = min(row0 + h, ty * TILE + TILE)
+                n = x1 - x0
+
+                for y in range(y0, y1):
+                    src = (y - ty * TILE) * TILE + (x0 - tx * TILE)
+                    dst = base + (y - row0) * stride + (x0 - col0)
+                    buffer[dst:dst+n] = tile[src:src+n]